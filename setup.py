@@ -11,7 +11,12 @@ with open('README.rst') as readme_file:
 with open('HISTORY.rst') as history_file:
     history = history_file.read()
 
-requirements = ['requests', 'six']
+requirements = ['requests', 'six', 'futures; python_version < "3"']
+
+extras_requirements = {
+    'async': ['aiohttp'],
+    'fast': ['orjson; python_version >= "3.6"', 'ujson; python_version < "3.6"'],
+}
 
 setup_requirements = ['pytest-runner', ]
 
@@ -33,7 +38,14 @@ setup(
         'Programming Language :: Python :: 3.6',
     ],
     description="Python client to connect to the TGATE server",
+    entry_points={
+        'console_scripts': [
+            'tgateclient=tgateclient.cli:main',
+            'tgateclient-daemon=tgateclient.daemon:main',
+        ],
+    },
     install_requires=requirements,
+    extras_require=extras_requirements,
     license="GNU General Public License v3",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
@@ -3,18 +3,38 @@
 
 """Tests for `tgateclient` package."""
 from tgateclient.client import TGateClient
+from tgateclient.testing import FakeTGateServer
 
 import os
 import six
 import pytest
+import requests
+import time
+
+
+@pytest.fixture(scope='module')
+def fake_server():
+    with FakeTGateServer('test', 'test', translation_time=1) as server:
+        yield server
 
 
 @pytest.fixture
-def client():
+def credentials(request):
+    """the server in TGATE_SERVER_URL or a local FakeTGateServer"""
     server_name = os.environ.get('TGATE_SERVER_URL')
+    if not server_name:
+        return request.getfixturevalue('fake_server').url, 'test', 'test'
     username = os.environ.get('TGATE_USERNAME')
     password = os.environ.get('TGATE_PASSWORD')
-    return TGateClient(server_name, username, password)
+    return server_name, username, password
+
+
+@pytest.fixture
+def client(credentials):
+    client = TGateClient(*credentials)
+    client.watcher.expected_duration = 1
+    yield client
+    client.close()
 
 
 def test_hello(client):
@@ -222,3 +242,812 @@ def test_translate_string(client):
         assert 'data' in response
         assert 'id' in response.get('data', {})
         assert response.get('data', {}).get('translation', '')
+
+
+def test_session_is_shared_and_closed():
+    with TGateClient('http://localhost/', 'username', 'password') as client:
+        session = client.session
+        assert client.session is session
+        assert session.get_adapter('http://localhost/')._pool_maxsize == client.pool_maxsize
+    assert client._session is None
+
+
+def test_async_hello(credentials):
+    aioclient = pytest.importorskip('tgateclient.aioclient')
+    import asyncio
+
+    async def hello():
+        async with aioclient.AsyncTGateClient(*credentials) as client:
+            return await client.hello()
+
+    hello_answer = asyncio.run(hello())
+    assert six.b("Translation Service says: hello") in hello_answer
+
+
+def test_translate_strings(client):
+    model_id = 'generic_es2en'
+    tr_mode = 'MachineTranslation'
+    mime_type = 'text/plain'
+    texts = ['Kaixo', 'Hola mundo', 'Buenos días']
+    responses = client.translate_strings(texts, model_id, tr_mode, mime_type, max_workers=2)
+    assert len(responses) == len(texts)
+    for response in responses:
+        assert response.get('status', '') == 'success'
+        assert response.get('data', {}).get('translation', '')
+
+
+def test_translation_cache(tmpdir):
+    from tgateclient.cache import TranslationCache
+    cache = TranslationCache(str(tmpdir.join('cache.db')), max_entries=10)
+    key = cache.key('Kaixo', 'generic_eu2es', 'MachineTranslation', 'text/plain')
+    assert key != cache.key('Kaixo', 'generic_eu2en', 'MachineTranslation', 'text/plain')
+    assert cache.get(key) is None
+    result = {'status': 'success', 'data': {'translation': 'Hola'}}
+    cache.set(key, result)
+    assert cache.get(key) == result
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+    for i in range(20):
+        cache.set(cache.key(str(i), 'm', 't', 'text/plain'), result)
+    assert cache.stats()['size'] <= 10
+    cache.close()
+
+
+def test_translate_string_uses_cache(tmpdir):
+    from tgateclient.cache import TranslationCache
+    cache = TranslationCache(str(tmpdir.join('cache.db')))
+    client = TGateClient('http://localhost/', 'username', 'password', cache=cache)
+    result = {'status': 'success', 'data': {'translation': 'Hola'}}
+    cache.set(cache.key('Kaixo', 'generic_eu2es', 'MachineTranslation', 'text/plain'), result)
+    assert client.translate_string('Kaixo', 'generic_eu2es', 'MachineTranslation', 'text/plain') == result
+
+
+def test_upload_docx_file_object(client):
+    testdocx = os.path.dirname(os.path.abspath(__file__)) + '/files/' + 'test1.docx'
+    with open(testdocx, 'rb') as fp:
+        response = client.upload(fp, progress=lambda sent, total: None)
+        assert not fp.closed
+    assert response.get('status') == 'success'
+    assert 'id' in response.get('data', {})
+    # clean
+    document_id = response.get('data', {}).get('id', {})
+    if document_id:
+        client.remove(document_id)
+
+
+def test_document_source_reads_in_chunks():
+    from tgateclient.streams import DocumentSource
+    testdocx = os.path.dirname(os.path.abspath(__file__)) + '/files/' + 'test1.docx'
+    with open(testdocx, 'rb') as fp:
+        contents = fp.read()
+    for document in (testdocx, contents):
+        with DocumentSource(document, filename='test1.docx', use_mmap=True) as source:
+            assert source.filename == 'test1.docx'
+            assert source.length == len(contents)
+            chunks = []
+            chunk = source.read(1000)
+            while chunk:
+                assert len(chunk) <= 1000
+                chunks.append(chunk)
+                chunk = source.read(1000)
+        assert b''.join(chunks) == contents
+    with pytest.raises(ValueError):
+        DocumentSource(contents)
+
+
+def test_download_document_to(client, tmpdir):
+    testdocx = os.path.dirname(os.path.abspath(__file__)) + '/files/' + 'test2.docx'
+    response = client.upload(testdocx)
+    document_id = response.get('data', {}).get('id', None)
+    destination = str(tmpdir.join('test2.docx'))
+    response = client.download_document_to(document_id, destination)
+    assert response.get('status', '') == 'success'
+    assert response.get('data', {}).get('size') == os.path.getsize(destination)
+    assert response.get('data', {}).get('path') == destination
+
+    # clean
+    client.remove(document_id)
+
+
+
+def test_download_document_to_resumes(tmpdir):
+    contents = os.urandom(256000)
+    with FakeTGateServer('test', 'test', drop_after=100000) as server:
+        with TGateClient(server.url, 'test', 'test') as client:
+            document_id = client.upload(contents, filename='dropped.bin')['data']['id']
+            destination = tmpdir.join('dropped.bin')
+            response = client.download_document_to(document_id, str(destination))
+            assert response['status'] == 'success'
+            assert response['data']['resumes'] >= 2
+            assert destination.read_binary() == contents
+
+            # files are removed when the download fails
+            response = client.download_document_to(document_id, str(destination), max_resumes=1)
+            assert response['status'] == 'error'
+            assert not destination.check()
+
+            def fail(*args, **kwargs):
+                raise ValueError('boom')
+
+            client._stream_to = fail
+            with pytest.raises(ValueError):
+                client.download_document_to(document_id, str(destination))
+            assert not destination.check()
+
+
+def test_download_document_to_checks_ranges(tmpdir):
+    contents = os.urandom(256000)
+    with FakeTGateServer('test', 'test', drop_after=100000) as server:
+        with TGateClient(server.url, 'test', 'test') as client:
+            document_id = client.upload(contents, filename='dropped.bin')['data']['id']
+            request = client._request
+            shifted = []
+
+            def shift_range(*args, **kwargs):
+                # the server answers a range that starts before the one asked for
+                headers = kwargs.get('headers') or {}
+                if 'Range' in headers and not shifted:
+                    written = int(headers['Range'][len('bytes='):-1])
+                    headers['Range'] = 'bytes={}-'.format(written - 10)
+                    shifted.append(written)
+                return request(*args, **kwargs)
+
+            client._request = shift_range
+            destination = tmpdir.join('dropped.bin')
+            response = client.download_document_to(document_id, str(destination), max_resumes=10)
+            assert shifted
+            assert response['status'] == 'success'
+            assert destination.read_binary() == contents
+
+
+def test_translate_files(client, tmpdir):
+    testfiles = os.path.dirname(os.path.abspath(__file__)) + '/files/'
+    paths = [testfiles + 'test3.docx', testfiles + 'test4.docx']
+    model_id = 'generic_es2en'
+    tr_mode = 'MachineTranslation'
+    results = list(client.translate_files(paths, model_id, tr_mode, str(tmpdir), concurrency=2))
+    assert len(results) == len(paths)
+    for result in results:
+        assert result.get('status', '') == 'success'
+        assert os.path.exists(result.get('data', {}).get('destination'))
+
+
+def test_iter_destinations():
+    from tgateclient.client import iter_destinations
+    paths = ['a/report.docx', 'b/report.docx', 'c/notes.txt', 'd/report.docx']
+    destinations = [destination for _, destination in iter_destinations(paths, 'out')]
+    assert destinations == [
+        os.path.join('out', 'report.docx'),
+        os.path.join('out', 'report (2).docx'),
+        os.path.join('out', 'notes.txt'),
+        os.path.join('out', 'report (3).docx'),
+    ]
+
+
+def test_status_watcher():
+    from tgateclient.watcher import StatusWatcher
+
+    class FakeClient(object):
+        def __init__(self):
+            self.polls = {}
+
+        def get_document_status(self, document_id):
+            self.polls[document_id] = self.polls.get(document_id, 0) + 1
+            if document_id == 'c':
+                return {'status': 'error', 'data': {'message': 'Unknown document'}}
+            if self.polls[document_id] == 2:
+                # a failed request, e.g. HTTP 503
+                return {}
+            if self.polls[document_id] < 3:
+                state = 'TRANSLATING'
+            else:
+                state = 'TRANSLATED'
+            return {'status': 'success', 'data': {'id': state}}
+
+    fake = FakeClient()
+    watcher = StatusWatcher(fake, min_interval=0.01, max_interval=0.05, expected_duration=0.01)
+    changes = []
+    futures = [
+        watcher.watch(document_id, callback=lambda *args: changes.append(args[:3]))
+        for document_id in ('a', 'b')
+    ]
+    for future in futures:
+        assert future.result(5).get('data', {}).get('id') == 'TRANSLATED'
+    assert ('a', None, 'TRANSLATING') in changes
+    assert ('a', 'TRANSLATING', 'TRANSLATED') in changes
+    assert watcher.watch('c').result(5)['status'] == 'error'
+    assert watcher.requests == 7
+    watcher.stop()
+
+
+def test_fake_server_checks_signature(fake_server):
+    client = TGateClient(fake_server.url, 'test', 'wrong-password')
+    assert client.models() == {}
+
+
+def test_benchmark(fake_server):
+    from tgateclient.benchmark import run_benchmark
+    from tgateclient.benchmark import percentile
+    values = list(range(1, 101))
+    assert [percentile(values, p) for p in (0, 50, 95, 99, 100)] == [1, 50, 95, 99, 100]
+    assert percentile([3], 99) == 3
+    assert percentile([], 50) is None
+    with TGateClient(fake_server.url, 'test', 'test') as client:
+        results = run_benchmark(client, requests=4, concurrency_levels=(1, 2), operations=['hello', 'upload'])
+    assert [result['operation'] for result in results] == ['hello', 'hello', 'upload', 'upload']
+    for result in results:
+        assert result['errors'] == 0
+        assert result['p50'] <= result['p99']
+
+
+def test_signer_matches_the_original_signature():
+    import datetime
+    import hashlib
+    import hmac
+    from tgateclient.signer import RequestSigner
+    signer = RequestSigner('username', 'password')
+    headers = signer.sign('translate/status', 'document-id')
+    datastring = '{}{}{}'.format(headers['timestamp'], 'document-id', 'translate/status')
+    expected = hmac.new(six.b('password'), six.b(datastring), hashlib.sha512).hexdigest()
+    assert headers['data'] == expected
+    assert headers['client'] == 'username'
+
+    server_time = datetime.datetime.utcnow() + datetime.timedelta(minutes=10)
+    signer.update_clock(server_time.strftime('%a, %d %b %Y %H:%M:%S GMT'))
+    assert 590 <= signer.offset <= 610
+
+
+def test_client_signs_with_server_clock(fake_server):
+    client = TGateClient(fake_server.url, 'test', 'test')
+    client.signer.offset = -3600
+    assert client.models() == {}
+    # the failed request taught the client the server time
+    assert client.models().get('status') == 'success'
+
+
+def test_metrics(fake_server):
+    from tgateclient.metrics import MetricsCollector
+    metrics = MetricsCollector()
+    with TGateClient(fake_server.url, 'test', 'test', metrics=metrics) as client:
+        client.models()
+        client.models()
+        client.get_document_status('this-is-an-unkown-document-id')
+        TGateClient(fake_server.url, 'test', 'wrong', metrics=metrics).models()
+    snapshot = metrics.snapshot()
+    models = snapshot['translate/models']
+    assert models['requests'] == 3
+    assert models['failures'] == 1
+    assert models['status_codes'] == {200: 2, 401: 1}
+    assert models['response_bytes'] > 0
+    assert models['latency']['total']['count'] == 3
+    assert models['latency']['connect']['sum'] > 0
+    assert snapshot['translate/status']['request_bytes'] > 0
+    text = metrics.to_prometheus()
+    assert 'tgateclient_requests_total{operation="translate/models"} 3' in text
+    assert 'tgateclient_latency_seconds_count{operation="translate/models",phase="sign"} 3' in text
+
+
+def test_split_text():
+    from tgateclient.segments import split_text
+    text = u'Kaixo mundua. Hau proba bat da.\n\nBeste paragrafo bat, testu gehiagorekin! Eta beste esaldi bat.\n'
+    segments = split_text(text, 'text/plain', 40)
+    assert u''.join(prefix + segment + suffix for prefix, segment, suffix in segments) == text
+    assert all(len(segment) <= 40 for _, segment, _ in segments)
+    html = u'<p>Kaixo <a href="http://example.com/a b">mundua</a>. Hau proba bat da.</p><p>Beste bat.</p>'
+    segments = split_text(html, 'text/html', 30)
+    assert u''.join(prefix + segment + suffix for prefix, segment, suffix in segments) == html
+    for _, segment, _ in segments:
+        assert segment.count('<') == segment.count('>')
+
+
+def test_translate_string_in_segments(client):
+    testhtml = os.path.dirname(os.path.abspath(__file__)) + '/files/' + 'test.html'
+    with open(testhtml, 'r') as fp:
+        text = fp.read()
+    model_id = 'generic_es2en'
+    tr_mode = 'MachineTranslation'
+    response = client.translate_string(text, model_id, tr_mode, 'text/html', max_segment_size=200)
+    assert response.get('status', '') == 'success'
+    assert response.get('data', {}).get('segments') > 1
+    assert response.get('data', {}).get('translation', '')
+
+
+def test_coalesce_identical_calls():
+    from tgateclient.client import iter_parallel
+    with pytest.raises(ValueError):
+        TGateClient('http://localhost/', 'test', 'test', coalesce=['upload'])
+    with FakeTGateServer('test', 'test', latency=0.2) as server:
+        client = TGateClient(server.url, 'test', 'test', coalesce=['translate_string'])
+        arguments = [('Kaixo', 'generic_eu2es', 'MachineTranslation', 'text/plain')] * 5
+        results = [result for _, result in iter_parallel(client.translate_string, arguments, 5)]
+        assert server.requests == 1
+        assert len(results) == 5
+        assert all(result['data']['translation'] == 'Kaixo' for result in results)
+        assert results[0] is not results[1]
+        client.close()
+
+
+def test_upload_index(fake_server, tmpdir):
+    from tgateclient.dedup import UploadIndex
+    index = UploadIndex(str(tmpdir.join('uploads.db')), validate_after=0)
+    testdocx = os.path.dirname(os.path.abspath(__file__)) + '/files/' + 'test5.docx'
+    with TGateClient(fake_server.url, 'test', 'test', upload_index=index) as client:
+        first = client.upload(testdocx)
+        document_id = first['data']['id']
+        requests = fake_server.requests
+        second = client.upload(testdocx)
+        assert second['data'] == {'id': document_id, 'reused': True}
+        # only get_document_properties was called to validate it
+        assert fake_server.requests == requests + 1
+        with open(testdocx, 'rb') as fp:
+            assert client.upload(fp.read(), filename='other.docx')['data']['id'] != document_id
+        client.remove(document_id)
+        third = client.upload(testdocx)
+        assert 'reused' not in third['data']
+        client.remove(third['data']['id'])
+
+
+def test_cli(fake_server, tmpdir, capsys):
+    from tgateclient import cli
+    source = tmpdir.mkdir('source')
+    source.mkdir('sub').join('a.txt').write('Kaixo mundua.')
+    source.join('b.html').write('<p>Kaixo</p>')
+    source.join('c.log').write('skip me')
+    output = tmpdir.join('output')
+    argv = [
+        str(source), str(output), '--url', fake_server.url, '--username', 'test',
+        '--password', 'test', '--model', 'generic_eu2es', '--strings',
+        '--exclude', '*.log', '--jobs', '2',
+    ]
+    assert cli.main(argv) == 0
+    assert output.join('sub', 'a.txt').read() == 'Kaixo mundua.'
+    assert output.join('b.html').read() == '<p>Kaixo</p>'
+    assert not output.join('c.log').check()
+    assert cli.main(argv) == 0
+    assert '0 translated, 0 failed, 2 up to date' in capsys.readouterr().out
+
+    testdocx = os.path.dirname(os.path.abspath(__file__)) + '/files/' + 'test6.docx'
+    documents = tmpdir.mkdir('documents')
+    documents.join('test6.docx').write_binary(open(testdocx, 'rb').read())
+    argv = [
+        str(documents), str(output), '--url', fake_server.url, '--username', 'test',
+        '--password', 'test', '--model', 'generic_es2en',
+    ]
+    assert cli.main(argv) == 0
+    assert output.join('test6.docx').size() == os.path.getsize(testdocx)
+
+
+def test_journal_resume(fake_server, tmpdir):
+    from tgateclient import journal
+    testfiles = os.path.dirname(os.path.abspath(__file__)) + '/files/'
+    job = journal.Journal(str(tmpdir.join('journal.db')))
+    for name in ('test5.docx', 'test6.docx'):
+        job.add(testfiles + name, str(tmpdir.join(name)), 'generic_es2en', 'MachineTranslation')
+
+    client = TGateClient(fake_server.url, 'test', 'test')
+    client.watcher.expected_duration = 0.1
+    download_document_to = client.download_document_to
+
+    def crash(*args):
+        raise IOError('disk full')
+
+    client.download_document_to = crash
+    results = list(job.resume(client, concurrency=2))
+    assert [result['state'] for result in results] == [journal.TRANSLATED] * 2
+    assert all(result['error'] == 'disk full' for result in results)
+
+    # a new process continues from the download
+    requests = fake_server.requests
+    client.download_document_to = download_document_to
+    job = journal.Journal(str(tmpdir.join('journal.db')))
+    results = list(job.resume(client))
+    assert [result['state'] for result in results] == [journal.DONE] * 2
+    # download, document and remove requests for each one
+    assert fake_server.requests == requests + 6
+    assert tmpdir.join('test5.docx').check()
+    assert list(job.resume(client)) == []
+    client.close()
+
+
+def test_journal_sweep(fake_server, tmpdir):
+    from tgateclient import journal
+    testfiles = os.path.dirname(os.path.abspath(__file__)) + '/files/'
+    job = journal.Journal(str(tmpdir.join('journal.db')))
+    job.add(testfiles + 'test7.docx', str(tmpdir.join('test7.docx')), 'unknown-model', 'MachineTranslation')
+    with TGateClient(fake_server.url, 'test', 'test') as client:
+        [result] = job.resume(client)
+        assert result['state'] == journal.UPLOADED
+        assert result['error']
+        assert job.sweep(client) == [result['document_id']]
+        assert result['document_id'] not in fake_server.documents
+        assert job.entries()[0]['state'] == journal.PENDING
+
+
+def test_aimd_limiter():
+    from tgateclient.limits import AIMDLimiter
+    limiter = AIMDLimiter(initial=4, max_limit=8)
+    for _ in range(40):
+        limiter.acquire()
+        limiter.release(0.01, 200)
+    assert limiter.limit == 8
+    limiter.acquire()
+    limiter.release(1, 200)
+    assert limiter.limit == 4
+    # only one decrease for the requests of the same period
+    limiter.acquire()
+    limiter.release(0.5, 503)
+    assert limiter.limit == 4
+    time.sleep(0.05)
+    limiter.acquire()
+    limiter.release(0.01, 503)
+    assert limiter.limit == 2
+    assert limiter.in_flight == 0
+
+
+def test_aimd_limiter_mixed_operations(monkeypatch):
+    from tgateclient import limits
+    # slow operations are not compared with fast ones
+    clock = [0]
+    monkeypatch.setattr(limits.time, 'time', lambda: clock[0])
+    limiter = limits.AIMDLimiter(initial=4, max_limit=64)
+    for _ in range(2500):
+        for operation, latency in (('translate/status', 0.02), ('translate/translate_string', 0.3)):
+            limiter.acquire()
+            clock[0] += latency
+            limiter.release(latency, 200, operation)
+    assert limiter.limit == 64
+
+
+def test_client_concurrency_limits():
+    from tgateclient.client import DOCUMENT_OPERATION
+    from tgateclient.client import iter_parallel
+    from tgateclient.limits import ConcurrencyLimits
+    limits = ConcurrencyLimits()
+    with FakeTGateServer('test', 'test', error_rate=1) as server:
+        with TGateClient(server.url, 'test', 'test', limits=limits) as client:
+            list(iter_parallel(client.models, [()] * 10, 4))
+    assert limits.light.limit == limits.light.min_limit
+    assert limits.heavy.limit == 2
+
+    # streamed downloads hold their slot until the body is read or closed
+    limits = ConcurrencyLimits()
+    with FakeTGateServer('test', 'test') as server:
+        with TGateClient(server.url, 'test', 'test', limits=limits) as client:
+            document_id = client.upload(b'x' * 5000, filename='a.txt')['data']['id']
+            url = client.download(document_id)['data']['id']
+            response = client._request(DOCUMENT_OPERATION, 'GET', url, stream=True)
+            assert limits.heavy.in_flight == 1
+            assert len(response.content) == 5000
+            assert limits.heavy.in_flight == 0
+            response = client._request(DOCUMENT_OPERATION, 'GET', url, stream=True)
+            assert limits.heavy.in_flight == 1
+            response.close()
+            response.close()
+            assert limits.heavy.in_flight == 0
+
+
+def test_hedged_requests():
+    from tgateclient.hedging import HedgePolicy
+    latencies = iter([2] + [0] * 100)
+    policy = HedgePolicy(default_delay=0.1, max_hedge_rate=1, min_samples=2)
+    with FakeTGateServer('test', 'test', latency=lambda: next(latencies)) as server:
+        with TGateClient(server.url, 'test', 'test', hedging=policy) as client:
+            start = time.time()
+            result = client.translate_string('Kaixo', 'generic_eu2es', 'MachineTranslation', 'text/plain')
+            assert time.time() - start < 1
+            assert result['data']['translation'] == 'Kaixo'
+            assert policy.hedges == 1
+            for _ in range(20):
+                client.models()
+            assert policy.delay('translate/models') < 0.1
+            # not hedged
+            client.hello()
+    assert policy.requests == 21
+
+
+def test_hedged_requests_run_on_the_calling_thread():
+    from tgateclient.client import iter_parallel
+    from tgateclient.hedging import HedgePolicy
+    from tgateclient.metrics import MetricsCollector
+    args = ('Kaixo', 'generic_eu2es', 'MachineTranslation', 'text/plain')
+    # the first copies are not queued behind max_workers
+    policy = HedgePolicy(default_delay=0.2, max_hedge_rate=0.01, max_workers=1)
+    with FakeTGateServer('test', 'test', latency=0.3) as server:
+        with TGateClient(server.url, 'test', 'test', hedging=policy, metrics=MetricsCollector()) as client:
+            start = time.time()
+            results = list(iter_parallel(client.translate_string, [args] * 8, 8))
+            assert time.time() - start < 0.6
+            assert all(result['data']['translation'] == 'Kaixo' for _, result in results)
+            assert policy.hedges == 0
+
+
+def test_typed_results(fake_server, tmpdir):
+    import copy
+    from tgateclient import results
+    from tgateclient.cache import TranslationCache
+    url, username, password = fake_server.url, 'test', 'test'
+    cache = TranslationCache(str(tmpdir.join('cache.db')))
+    with TGateClient(url, username, password, typed_results=True, cache=cache) as client:
+        result = client.translate_string('Kaixo', 'generic_eu2es', 'MachineTranslation', 'text/plain')
+        assert isinstance(result, results.TranslationResult)
+        assert result.ok and result.translation == 'Kaixo'
+        assert result['data']['translation'] == 'Kaixo'
+        assert result.to_dict()['status'] == 'success'
+        assert copy.deepcopy(result) == result
+        cached = client.translate_string('Kaixo', 'generic_eu2es', 'MachineTranslation', 'text/plain')
+        assert cached.translation == 'Kaixo'
+
+        models = client.models()
+        assert isinstance(models, results.ModelList)
+        assert models._data is None
+        assert 'generic_eu2es' in models.models
+
+        upload = client.upload(os.path.dirname(os.path.abspath(__file__)) + '/files/test5.docx')
+        status = client.get_document_status(upload.id)
+        assert status.get('status') == 'success'
+        assert status.state == 'READY'
+        client.remove(upload.id)
+        assert not client.get_document_status(upload.id).ok
+
+    with TGateClient(url, username, password, cache=cache) as client:
+        result = client.translate_string('Kaixo', 'generic_eu2es', 'MachineTranslation', 'text/plain')
+        assert type(result) is dict
+    cache.close()
+
+
+def test_compression(tmpdir):
+    from tgateclient.compression import Compression
+    text = u'Kaixo mundua. ' * 500
+    path = tmpdir.join('document.txt')
+    path.write(text)
+    compression = Compression()
+    with FakeTGateServer('test', 'test', compression=True) as server:
+        with TGateClient(server.url, 'test', 'test', compression=compression) as client:
+            # nothing is compressed until the server accepts it
+            client.hello()
+            assert compression.encoding == 'gzip'
+            result = client.translate_string(text, 'generic_eu2es', 'MachineTranslation', 'text/plain')
+            assert result['data']['translation'] == text
+            upload = client.upload(str(path))
+            document_id = upload['data']['id']
+            assert server.documents[document_id]['contents'] == text.encode('utf-8')
+            destination = tmpdir.join('translated.txt')
+            assert client.download_document_to(document_id, str(destination))['status'] == 'success'
+            assert destination.read() == text
+    stats = compression.stats()
+    assert stats['request_wire_bytes'] < stats['request_bytes'] / 10
+    assert stats['response_wire_bytes'] < stats['response_bytes'] / 10
+    assert stats['saved_bytes'] > 2 * len(text)
+
+    compression = Compression(assume_accepted=True)
+    with FakeTGateServer('test', 'test') as server:
+        with TGateClient(server.url, 'test', 'test', compression=compression) as client:
+            result = client.translate_string(text, 'generic_eu2es', 'MachineTranslation', 'text/plain')
+            assert result['data']['translation'] == text
+            assert compression.encoding is None
+            assert server.requests == 2
+
+    # uploads are sent again uncompressed, also from files passed in
+    for document in (b'x' * 5000, six.BytesIO(b'x' * 5000)):
+        compression = Compression(assume_accepted=True)
+        with FakeTGateServer('test', 'test') as server:
+            with TGateClient(server.url, 'test', 'test', compression=compression) as client:
+                result = client.upload(document, filename='a.txt')
+                assert result['status'] == 'success'
+                assert server.documents[result['data']['id']]['contents'] == b'x' * 5000
+                assert compression.encoding is None
+
+
+def test_daemon(fake_server, tmpdir):
+    from tgateclient.daemon import DaemonClient
+    from tgateclient.daemon import TranslationDaemon
+    path = str(tmpdir.join('daemon.sock'))
+    source = tmpdir.join('source.txt')
+    source.write('Kaixo')
+    with TGateClient(fake_server.url, 'test', 'test') as client:
+        with TranslationDaemon(client, path) as daemon:
+            with pytest.raises(RuntimeError):
+                TranslationDaemon(client, path).start()
+            with DaemonClient(path) as proxy:
+                assert proxy.hello() == b'Translation Service says: hello'
+                result = proxy.translate_string('Kaixo', 'generic_eu2es', 'MachineTranslation', 'text/plain')
+                assert result['data']['translation'] == 'Kaixo'
+                results = proxy.translate_strings(['Kaixo', 'Agur'], 'generic_eu2es', 'MachineTranslation', 'text/plain')
+                assert [r['data']['translation'] for r in results] == ['Kaixo', 'Agur']
+
+                requests = fake_server.requests
+                assert proxy.models()['status'] == 'success'
+                assert proxy.models()['status'] == 'success'
+                assert fake_server.requests == requests + 1
+
+                document_id = proxy.upload(b'Kaixo', filename='kaixo.txt')['data']['id']
+                assert proxy.download_document(document_id)['data']['contents'] == b'Kaixo'
+                proxy.remove(document_id)
+
+                with open(str(source), 'rb') as fp:
+                    document_id = proxy.upload(fp)['data']['id']
+                assert fake_server.documents[document_id]['filename'] == 'source.txt'
+                proxy.remove(document_id)
+
+                destination = tmpdir.join('translated.txt')
+                result = proxy.translate_file(str(source), 'generic_eu2es', 'MachineTranslation', str(destination))
+                assert result['status'] == 'success'
+                assert destination.read() == 'Kaixo'
+
+                with pytest.raises(RuntimeError):
+                    proxy._call('close')
+                assert daemon.stats()['connections'] == 1
+            assert os.stat(path).st_mode & 0o777 == 0o600
+    assert not os.path.exists(path)
+
+
+def test_daemon_socket_path(monkeypatch, tmpdir):
+    import tempfile
+    from tgateclient.daemon import DaemonClient
+    from tgateclient.daemon import default_socket_path
+    monkeypatch.delenv('TGATE_DAEMON_SOCKET', raising=False)
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmpdir))
+    assert default_socket_path() == str(tmpdir.join('tgateclient.sock'))
+
+    monkeypatch.delenv('XDG_RUNTIME_DIR')
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmpdir))
+    path = default_socket_path()
+    directory = os.path.dirname(path)
+    assert os.stat(directory).st_mode & 0o777 == 0o700
+    os.chmod(directory, 0o755)
+    with pytest.raises(RuntimeError):
+        default_socket_path()
+
+    # sockets of other users are not trusted
+    tmpdir.join('other.sock').write('')
+    monkeypatch.setattr(os, 'getuid', lambda: os.stat(str(tmpdir)).st_uid + 1)
+    with pytest.raises(RuntimeError):
+        DaemonClient(str(tmpdir.join('other.sock'))).hello()
+
+
+def test_routing(tmpdir):
+    from tgateclient.routing import CircuitOpenError
+    from tgateclient.routing import Router
+    source = tmpdir.join('source.txt')
+    source.write('Kaixo')
+    first = FakeTGateServer('test', 'test').start()
+    second = FakeTGateServer('test', 'test').start()
+    router = Router([first.url, second.url], failure_threshold=1, probe_interval=0.1)
+    # a stopped server still answers on the connections it has open
+    with TGateClient(None, 'test', 'test', keep_alive=False, router=router) as client:
+        client.watcher.expected_duration = 1
+        assert client.hello()
+        for index in range(2):
+            destination = tmpdir.join('translated{}.txt'.format(index))
+            result = client.translate_file(str(source), 'generic_eu2es', 'MachineTranslation', str(destination))
+            assert result['status'] == 'success'
+        assert first.requests and second.requests
+
+        document_id = client.upload(str(source))['data']['id']
+        on_second = document_id in second.documents
+        down, up = (second, first) if on_second else (first, second)
+        down.stop()
+        failures = 0
+        for _ in range(5):
+            try:
+                assert client.models()['status'] == 'success'
+            except requests.exceptions.ConnectionError:
+                failures += 1
+        assert failures <= 1
+        with pytest.raises(CircuitOpenError):
+            client.get_document_status(document_id)
+        states = [endpoint['state'] for endpoint in router.snapshot()]
+        assert sorted(states) == ['closed', 'open']
+    up.stop()
+
+
+def test_router_half_open():
+    from tgateclient.routing import Router
+    router = Router(['http://a/', 'http://b/'], reset_timeout=10)
+    for endpoint in router.endpoints:
+        endpoint.state = 'open'
+        endpoint.opened_at = time.time() - 10
+    # only the endpoint that gets the trial request is half open
+    endpoint = router.acquire()
+    assert sorted(e.state for e in router.endpoints) == ['half_open', 'open']
+    router.release(endpoint, 0.1, True)
+    assert endpoint.state == 'closed'
+
+
+def test_routing_pins_across_processes(tmpdir):
+    from tgateclient import journal
+    from tgateclient.dedup import UploadIndex
+    from tgateclient.routing import Router
+    testfiles = os.path.dirname(os.path.abspath(__file__)) + '/files/'
+    servers = [FakeTGateServer('test', 'test').start() for _ in range(2)]
+    urls = [server.url for server in servers]
+    index = UploadIndex(str(tmpdir.join('uploads.db')), validate_after=0)
+    job = journal.Journal(str(tmpdir.join('journal.db')))
+    for name in ('test5.docx', 'test6.docx'):
+        job.add(testfiles + name, str(tmpdir.join(name)), 'generic_es2en', 'MachineTranslation')
+    with TGateClient(urls, 'test', 'test', upload_index=index) as client:
+        document_id = client.upload(testfiles + 'test7.docx')['data']['id']
+        client.translate_document = lambda *args: {}
+        results = list(job.resume(client))
+        assert [result['state'] for result in results] == [journal.UPLOADED] * 2
+        # each server got one of them
+        assert sorted(len(server.documents) for server in servers) == [1, 2]
+
+    # new clients do not know where the documents are but the index and the
+    # journal do
+    for _ in range(3):
+        with TGateClient(urls, 'test', 'test', upload_index=index) as client:
+            result = client.upload(testfiles + 'test7.docx')
+            assert result['data'] == {'id': document_id, 'reused': True}
+            assert client.get_document_status(document_id)['status'] == 'success'
+    with TGateClient(urls, 'test', 'test') as client:
+        client.watcher.expected_duration = 0.1
+        results = list(job.resume(client))
+        assert [result['state'] for result in results] == [journal.DONE] * 2
+    for server in servers:
+        server.stop()
+
+
+def test_translation_memory(fake_server):
+    from tgateclient.memory import TranslationMemory
+    memory = TranslationMemory(':memory:', threshold=0.8)
+    args = ('generic_eu2es', 'MachineTranslation', 'text/html')
+    with TGateClient(fake_server.url, 'test', 'test', memory=memory) as client:
+        result = client.translate_string(u'Invoice 123 of <b>Bilbao</b> is due on 2024-05-01', *args)
+        assert 'match' not in result['data']
+        requests = fake_server.requests
+
+        result = client.translate_string(u'Invoice  456 of <i>Bilbao</i> is due on 2025-06-02', *args)
+        assert result['data']['match'] == 1
+        assert result['data']['translation'] == u'Invoice 456 of <i>Bilbao</i> is due on 2025-06-02'
+        assert result['data']['source'] == u'Invoice 123 of <b>Bilbao</b> is due on 2024-05-01'
+
+        result = client.translate_string(u'Invoice 7 of <b>Bilbao</b> was due on 2025-06-02', *args)
+        assert 0.8 < result['data']['match'] < 1
+        assert result['data']['translation'] == u'Invoice 7 of <b>Bilbao</b> is due on 2025-06-02'
+        assert fake_server.requests == requests
+
+        result = client.translate_string(u'Invoice 7 of <b>Bilbao</b> was due on 2025-06-02', *args, use_memory=False)
+        assert 'match' not in result['data']
+        result = client.translate_string(u'Invoice 7 of <b>Bilbao</b> is due on 2025-06-02', 'generic_es2en', *args[1:])
+        assert 'match' not in result['data']
+        assert fake_server.requests == requests + 2
+    assert memory.stats()['size'] == 2
+
+    # translations that do not keep every number and tag are only used for
+    # the same text
+    args = ('generic_en2es', 'MachineTranslation', 'text/html')
+    memory.add(u'Pay 1,000 euros now', u'Paga 1.000 euros ahora', *args)
+    memory.add(u'Open <b>file</b> 3', u'Abre el fichero 3', *args)
+    assert memory.lookup(u'Pay 2,000 euros now', *args) is None
+    assert memory.lookup(u'Open <i>file</i> 4', *args) is None
+    assert memory.lookup(u'Open <b>file</b> 3', *args) == (1.0, u'Abre el fichero 3', u'Open <b>file</b> 3')
+    memory.add(u'Pay 5 euros now', u'Paga 5 euros ahora', *args)
+    assert memory.lookup(u'Pay 7 euros now', *args)[1] == u'Paga 7 euros ahora'
+    assert memory.lookup(u'Pay 7 euros now!', *args)[1] == u'Paga 7 euros ahora'
+    memory.close()
+
+
+def test_retry_policy():
+    from tgateclient.retry import parse_retry_after
+    from tgateclient.retry import RetryPolicy
+    assert parse_retry_after('120') == 120
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT', now=1445412470) == 10
+    assert parse_retry_after('soon') is None
+
+    policy = RetryPolicy(max_attempts=3, backoff=0.01, budget=3, budget_ratio=0)
+    with FakeTGateServer('test', 'test', error_rate=1) as server:
+        with TGateClient(server.url, 'test', 'test', retry=policy) as client:
+            assert client.models() == {}
+            assert server.requests == 3
+            # not safe to repeat
+            assert client.translate_document('1', 'generic_eu2es', 'MachineTranslation') == {}
+            assert server.requests == 4
+            # the budget only has one retry left
+            assert client.get_document_status('1') == {}
+            assert server.requests == 6
+            assert policy.retries == 3
+            assert policy.exhausted == 1
+    with pytest.raises(requests.exceptions.ConnectionError):
+        with TGateClient(server.url, 'test', 'test', retry=RetryPolicy(backoff=0.01)) as client:
+            client.models()
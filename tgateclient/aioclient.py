@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""asyncio version of TGateClient. Requires aiohttp:
+
+    pip install tgateclient[async]
+"""
+import aiohttp
+import os
+
+from .client import BaseTGateClient
+from .client import POOL_MAXSIZE
+from .client import STRING_TIMEOUT
+from .client import TIMEOUT
+
+POOL_LIMIT = 100
+
+
+class AsyncTGateClient(BaseTGateClient):
+    def __init__(
+        self,
+        url,
+        username,
+        password,
+        pool_limit=POOL_LIMIT,
+        pool_maxsize=POOL_MAXSIZE,
+        keep_alive=True,
+    ):
+        """pool_limit is the total number of simultaneous connections and
+        pool_maxsize the number of simultaneous connections to each host.
+        """
+        super(AsyncTGateClient, self).__init__(url, username, password)
+        self.pool_limit = pool_limit
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _build_session(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_limit,
+            limit_per_host=self.pool_maxsize,
+            force_close=not self.keep_alive,
+        )
+        return aiohttp.ClientSession(connector=connector)
+
+    @property
+    def session(self):
+        # the event loop runs on a single thread, so no locking is needed
+        if self._session is None or self._session.closed:
+            self._session = self._build_session()
+        return self._session
+
+    async def close(self):
+        session, self._session = self._session, None
+        if session is not None:
+            await session.close()
+
+    async def _request(self, method, url, timeout=None, **kwargs):
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+        response = await self.session.request(method, url, **kwargs)
+        self.signer.update_clock(response.headers.get("Date"))
+        return response
+
+    async def _json_or_empty(self, response):
+        async with response:
+            if response.status == 200:
+                return await response.json(content_type=None)
+            else:
+                return {}
+
+    async def hello(self):
+        operation = "test/hello"
+        url = self._build_url(operation)
+        response = await self._request("GET", url)
+        async with response:
+            if response.status == 200:
+                return await response.read()
+            else:
+                return {}
+
+    async def upload(self, filename):
+        operation = "translate/upload"
+        url = self._build_url(operation)
+        headers = self._build_headers(operation, os.path.basename(filename))
+        with open(filename, "rb") as fp:
+            data = aiohttp.FormData()
+            data.add_field(
+                "file",
+                fp,
+                filename=os.path.basename(filename),
+                content_type="application/octet-stream",
+            )
+            response = await self._request("POST", url, data=data, headers=headers)
+        return await self._json_or_empty(response)
+
+    async def download(self, document_id):
+        operation = "translate/download"
+        url = self._build_url(operation)
+        headers = self._build_headers(operation, document_id)
+        json = {"id": document_id}
+        response = await self._request(
+            "POST", url, json=json, headers=headers, timeout=TIMEOUT
+        )
+        return await self._json_or_empty(response)
+
+    async def download_document(self, document_id):
+        response = await self.download(document_id)
+        if response.get("status") == "success":
+            document_url = response.get("data", {}).get("id", "")
+            if document_url.startswith("http"):
+                data = await self._request("GET", document_url)
+                async with data:
+                    contents = await data.read()
+                return {"status": "success", "data": {"contents": contents}}
+
+    async def remove(self, document_id):
+        operation = "translate/remove_document"
+        url = self._build_url(operation)
+        headers = self._build_headers(operation, document_id)
+        json = {"id": document_id}
+        response = await self._request(
+            "POST", url, json=json, headers=headers, timeout=TIMEOUT
+        )
+        return await self._json_or_empty(response)
+
+    async def get_document_properties(self, document_id):
+        operation = "translate/properties"
+        url = self._build_url(operation)
+        headers = self._build_headers(operation, document_id)
+        json = {"id": document_id}
+        response = await self._request(
+            "POST", url, json=json, headers=headers, timeout=TIMEOUT
+        )
+        return await self._json_or_empty(response)
+
+    async def get_document_status(self, document_id):
+        operation = "translate/status"
+        url = self._build_url(operation)
+        headers = self._build_headers(operation, document_id)
+        json = {"id": document_id}
+        response = await self._request(
+            "POST", url, json=json, headers=headers, timeout=TIMEOUT
+        )
+        return await self._json_or_empty(response)
+
+    async def get_document_id(self, filename):
+        operation = "translate/document_id"
+        url = self._build_url(operation)
+        headers = self._build_headers(operation, filename)
+        json = {"filename": filename}
+        response = await self._request(
+            "POST", url, json=json, headers=headers, timeout=TIMEOUT
+        )
+        return await self._json_or_empty(response)
+
+    async def models(self):
+        operation = "translate/models"
+        url = self._build_url(operation)
+        headers = self._build_headers(operation)
+        response = await self._request("GET", url, headers=headers, timeout=TIMEOUT)
+        return await self._json_or_empty(response)
+
+    async def translate_document(self, document_id, model_id, tr_mode):
+        operation = "translate/translate_document"
+        url = self._build_url(operation)
+        headers = self._build_headers(operation, document_id, model_id)
+        json = {"document_id": document_id, "model_id": model_id, "tr_mode": tr_mode}
+        response = await self._request(
+            "POST", url, json=json, headers=headers, timeout=TIMEOUT
+        )
+        return await self._json_or_empty(response)
+
+    async def translate_string(self, text, model_id, tr_mode, mime_type):
+        operation = "translate/translate_string"
+        url = self._build_url(operation)
+        headers = self._build_headers(operation, text, model_id, mime_type)
+        json = {
+            "text": text,
+            "model_id": model_id,
+            "tr_mode": tr_mode,
+            "mime": mime_type,
+        }
+        response = await self._request(
+            "POST", url, json=json, headers=headers, timeout=STRING_TIMEOUT
+        )
+        result = await self._json_or_empty(response)
+        if result and result["status"] == "success":
+            result["data"]["translation"] = self._get_translation_from_result(
+                result["data"]["message"]
+            )
+        return result
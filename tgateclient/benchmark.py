@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Measures the throughput and latency of every TGateClient operation.
+
+By default it runs against a local FakeTGateServer, so it measures the
+overhead of the client itself:
+
+    python -m tgateclient.benchmark --requests 200 --concurrency 1,4,16
+
+Use --url, --username and --password to benchmark a real server instead.
+"""
+from __future__ import print_function
+
+import argparse
+import math
+import os
+import threading
+import time
+
+from .client import iter_parallel
+from .client import TGateClient
+from .testing import FakeTGateServer
+
+MODEL_ID = "generic_es2en"
+TR_MODE = "MachineTranslation"
+TEXT = u"Hola mundo. Esta es una frase de prueba."
+DOCUMENT_SIZE = 64 * 1024
+
+
+def percentile(values, percent):
+    """nearest-rank percentile of an already sorted list"""
+    if not values:
+        return None
+    index = max(int(math.ceil(percent * len(values) / 100.0)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def _operations(client, document_id, document):
+    def upload():
+        result = client.upload(document, filename="benchmark.docx")
+        uploaded.append(result.get("data", {}).get("id"))
+        return result
+
+    uploaded = []
+    operations = [
+        ("hello", client.hello),
+        ("models", client.models),
+        (
+            "translate_string",
+            lambda: client.translate_string(TEXT, MODEL_ID, TR_MODE, "text/plain"),
+        ),
+        ("upload", upload),
+        ("download", lambda: client.download(document_id)),
+        ("download_document", lambda: client.download_document(document_id)),
+        ("get_document_status", lambda: client.get_document_status(document_id)),
+        (
+            "get_document_properties",
+            lambda: client.get_document_properties(document_id),
+        ),
+        ("get_document_id", lambda: client.get_document_id("benchmark.docx")),
+        (
+            "translate_document",
+            lambda: client.translate_document(document_id, MODEL_ID, TR_MODE),
+        ),
+    ]
+    return operations, uploaded
+
+
+def _timed(function):
+    start = time.time()
+    try:
+        result = function()
+        ok = result is not None and result != {} and (
+            not isinstance(result, dict) or result.get("status") == "success"
+        )
+    except Exception:
+        ok = False
+    return time.time() - start, ok
+
+
+def run_operation(function, requests, concurrency):
+    """call function requests times keeping concurrency calls in flight,
+    and return the throughput and latency percentiles in milliseconds
+    """
+    lock = threading.Lock()
+    latencies = []
+    errors = [0]
+
+    def call():
+        elapsed, ok = _timed(function)
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors[0] += 1
+
+    start = time.time()
+    for _ in iter_parallel(call, (() for _ in range(requests)), concurrency):
+        pass
+    total = time.time() - start
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors[0],
+        "throughput": requests / total if total else None,
+        "p50": percentile(latencies, 50) * 1000,
+        "p95": percentile(latencies, 95) * 1000,
+        "p99": percentile(latencies, 99) * 1000,
+    }
+
+
+def run_benchmark(
+    client,
+    requests=100,
+    concurrency_levels=(1, 4, 16),
+    operations=None,
+    document_size=DOCUMENT_SIZE,
+):
+    """benchmark the operations of client, returning a list of results, one
+    per operation and concurrency level
+    """
+    document = os.urandom(document_size)
+    document_id = client.upload(document, filename="benchmark.docx")["data"]["id"]
+    available, uploaded = _operations(client, document_id, document)
+    results = []
+    try:
+        for name, function in available:
+            if operations and name not in operations:
+                continue
+            for concurrency in concurrency_levels:
+                result = run_operation(function, requests, concurrency)
+                result["operation"] = name
+                results.append(result)
+    finally:
+        for uploaded_id in [document_id] + uploaded:
+            if uploaded_id:
+                client.remove(uploaded_id)
+    return results
+
+
+def format_results(results):
+    lines = [
+        "{:<24} {:>5} {:>8} {:>7} {:>10} {:>9} {:>9} {:>9}".format(
+            "operation", "conc", "requests", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms"
+        )
+    ]
+    for result in results:
+        lines.append(
+            "{operation:<24} {concurrency:>5} {requests:>8} {errors:>7} "
+            "{throughput:>10.1f} {p50:>9.2f} {p95:>9.2f} {p99:>9.2f}".format(**result)
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--operations", help="comma separated operation names")
+    parser.add_argument(
+        "--document-size", type=int, default=DOCUMENT_SIZE, help="in bytes"
+    )
+    parser.add_argument("--url", help="benchmark this server instead of a local one")
+    parser.add_argument("--username", default="test")
+    parser.add_argument("--password", default="test")
+    parser.add_argument(
+        "--latency", type=float, default=0, help="latency of the local server"
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0, help="error rate of the local server"
+    )
+    args = parser.parse_args(argv)
+    concurrency_levels = [int(value) for value in args.concurrency.split(",")]
+    operations = args.operations.split(",") if args.operations else None
+
+    server = None
+    url = args.url
+    if url is None:
+        server = FakeTGateServer(
+            args.username, args.password, latency=args.latency, error_rate=args.error_rate
+        ).start()
+        url = server.url
+    try:
+        with TGateClient(
+            url, args.username, args.password, pool_maxsize=max(concurrency_levels)
+        ) as client:
+            results = run_benchmark(
+                client, args.requests, concurrency_levels, operations, args.document_size
+            )
+    finally:
+        if server is not None:
+            server.stop()
+    print(format_results(results))
+
+
+if __name__ == "__main__":
+    main()
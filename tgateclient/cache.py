@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""On-disk translation memory used by TGateClient.translate_string"""
+import hashlib
+import json
+import six
+import sqlite3
+import threading
+import time
+
+from .client import safe_encode
+
+MAX_ENTRIES = 100000
+
+
+class TranslationCache(object):
+    """cache of successful translate_string results stored in a SQLite
+    database.
+
+    Entries older than max_age seconds are ignored and, once there are more
+    than max_entries, the oldest ones are removed.
+    """
+
+    def __init__(self, path, max_entries=MAX_ENTRIES, max_age=None):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS translations "
+            "(key TEXT PRIMARY KEY, result TEXT, created REAL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS translations_created "
+            "ON translations (created)"
+        )
+        self._connection.commit()
+        self._size = self._connection.execute(
+            "SELECT COUNT(*) FROM translations"
+        ).fetchone()[0]
+
+    def key(self, text, model_id, tr_mode, mime_type):
+        data = u"\0".join(
+            [six.text_type(value) for value in (model_id, tr_mode, mime_type)]
+        )
+        return hashlib.sha256(safe_encode(data) + b"\0" + safe_encode(text)).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT result, created FROM translations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self._expired(row[1]):
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, result):
+        value = json.dumps(result)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+            self._size += 1
+            self._evict()
+            self._connection.commit()
+
+    def _expired(self, created):
+        return self.max_age is not None and created < time.time() - self.max_age
+
+    def _evict(self):
+        # self._size also counts replaced rows, so it is only an upper bound
+        # that gets fixed here
+        if self._size <= self.max_entries:
+            return
+        self._purge()
+        self._size = self._connection.execute(
+            "SELECT COUNT(*) FROM translations"
+        ).fetchone()[0]
+        if self._size > self.max_entries:
+            # remove some extra entries so we do not evict on every insert
+            extra = self._size - self.max_entries + self.max_entries // 10
+            self._connection.execute(
+                "DELETE FROM translations WHERE key IN "
+                "(SELECT key FROM translations ORDER BY created LIMIT ?)",
+                (extra,),
+            )
+            self._size = max(self._size - extra, 0)
+
+    def _purge(self):
+        if self.max_age is not None:
+            self._connection.execute(
+                "DELETE FROM translations WHERE created < ?",
+                (time.time() - self.max_age,),
+            )
+
+    def purge(self):
+        """remove the expired entries"""
+        with self._lock:
+            self._purge()
+            self._connection.commit()
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM translations")
+            self._connection.commit()
+            self._size = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": self._size}
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
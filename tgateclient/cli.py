@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""Translate a whole directory tree:
+
+    tgateclient --model generic_es2en source/ translated/
+
+Documents are uploaded and translated on the server by default; use
+--strings to send the contents of text files with translate_string instead.
+The server and credentials are taken from the TGATE_SERVER_URL,
+TGATE_USERNAME and TGATE_PASSWORD environment variables unless given.
+"""
+from __future__ import print_function
+
+import argparse
+import fnmatch
+import io
+import os
+import sys
+import time
+
+from .benchmark import percentile
+from .client import iter_parallel
+from .client import MAX_WORKERS
+from .client import TGateClient
+
+TR_MODE = "MachineTranslation"
+MIME_TYPES = {".html": "text/html", ".htm": "text/html", ".xml": "text/xml"}
+
+
+def find_files(source_dir, output_dir, include, exclude, force):
+    """yields (source, destination) pairs for the files to translate, and
+    (source, None) for the ones whose translation is up to date
+    """
+    for directory, dirnames, filenames in os.walk(source_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            source = os.path.join(directory, filename)
+            relative = os.path.relpath(source, source_dir).replace(os.sep, "/")
+            if not any(fnmatch.fnmatch(relative, pattern) for pattern in include):
+                continue
+            if any(fnmatch.fnmatch(relative, pattern) for pattern in exclude):
+                continue
+            destination = os.path.join(output_dir, relative)
+            if not force and os.path.exists(destination):
+                if os.path.getmtime(destination) >= os.path.getmtime(source):
+                    yield source, None
+                    continue
+            yield source, destination
+
+
+def _makedirs(path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # created by another worker
+            if not os.path.isdir(directory):
+                raise
+
+
+def translate_document(client, source, destination, model_id, tr_mode):
+    _makedirs(destination)
+    return client.translate_file(source, model_id, tr_mode, destination)
+
+
+def translate_text_file(
+    client, source, destination, model_id, tr_mode, mime_type, max_segment_size
+):
+    with io.open(source, encoding="utf-8") as fp:
+        text = fp.read()
+    mime_type = mime_type or MIME_TYPES.get(
+        os.path.splitext(source)[1].lower(), "text/plain"
+    )
+    result = client.translate_string(
+        text, model_id, tr_mode, mime_type, max_segment_size=max_segment_size
+    )
+    if result.get("status") == "success":
+        _makedirs(destination)
+        with io.open(destination, "w", encoding="utf-8") as fp:
+            fp.write(result["data"]["translation"])
+    return result or {"status": "error", "data": {"message": "request failed"}}
+
+
+def _timed(function, *args):
+    start = time.time()
+    try:
+        result = function(*args)
+    except Exception as e:
+        result = {"status": "error", "data": {"message": str(e)}}
+    return args[1], result, time.time() - start
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="\n".join(__doc__.splitlines()[1:]),
+    )
+    parser.add_argument("source_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--model", required=True, help="model_id to translate with")
+    parser.add_argument("--mode", default=TR_MODE, help="tr_mode")
+    parser.add_argument("--url", default=os.environ.get("TGATE_SERVER_URL"))
+    parser.add_argument("--username", default=os.environ.get("TGATE_USERNAME"))
+    parser.add_argument("--password", default=os.environ.get("TGATE_PASSWORD"))
+    parser.add_argument(
+        "--strings",
+        action="store_true",
+        help="translate the contents of text files with translate_string",
+    )
+    parser.add_argument("--mime", help="mime type in --strings mode")
+    parser.add_argument(
+        "--max-segment-size",
+        type=int,
+        help="split long texts in segments in --strings mode",
+    )
+    parser.add_argument("-j", "--jobs", type=int, default=MAX_WORKERS)
+    parser.add_argument(
+        "--include", action="append", help="glob of the files to translate"
+    )
+    parser.add_argument(
+        "--exclude", action="append", default=[], help="glob of the files to skip"
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="translate up to date files too"
+    )
+    args = parser.parse_args(argv)
+    if not args.url:
+        parser.error("--url or TGATE_SERVER_URL is required")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    files = list(
+        find_files(
+            args.source_dir,
+            args.output_dir,
+            args.include or ["*"],
+            args.exclude,
+            args.force,
+        )
+    )
+    pending = [(source, destination) for source, destination in files if destination]
+    skipped = len(files) - len(pending)
+
+    latencies = []
+    failed = 0
+    size = 0
+    start = time.time()
+    with TGateClient(
+        args.url, args.username, args.password, pool_maxsize=args.jobs
+    ) as client:
+        if args.strings:
+            arguments = (
+                (
+                    translate_text_file,
+                    client,
+                    source,
+                    destination,
+                    args.model,
+                    args.mode,
+                    args.mime,
+                    args.max_segment_size,
+                )
+                for source, destination in pending
+            )
+        else:
+            arguments = (
+                (translate_document, client, source, destination, args.model, args.mode)
+                for source, destination in pending
+            )
+        for _, (source, result, elapsed) in iter_parallel(
+            _timed, arguments, args.jobs
+        ):
+            latencies.append(elapsed)
+            if result.get("status") == "success":
+                size += os.path.getsize(source)
+                print("OK     {}".format(source))
+            else:
+                failed += 1
+                message = result.get("data", {}).get("message", "")
+                print("ERROR  {} {}".format(source, message), file=sys.stderr)
+    total = time.time() - start
+
+    latencies.sort()
+    print("")
+    print(
+        "{} translated, {} failed, {} up to date in {:.1f}s".format(
+            len(pending) - failed, failed, skipped, total
+        )
+    )
+    if latencies and total:
+        print(
+            "{:.2f} files/s, {:.1f} KB/s, latency p50 {:.2f}s p95 {:.2f}s "
+            "max {:.2f}s".format(
+                len(pending) / total,
+                size / 1024.0 / total,
+                percentile(latencies, 50),
+                percentile(latencies, 95),
+                latencies[-1],
+            )
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,176 +1,1190 @@
 # -*- coding: utf-8 -*-
-import datetime
-import hashlib
-import hmac
+from concurrent import futures
+
+import contextlib
+import itertools
 import os
+import re
 import requests
+import requests.adapters
 import six
+import sys
+import threading
+import time
+
+from .compression import wire_size
+from .hedging import HEDGE
+from .hedging import HedgedRequest
+from .hedging import HedgeTimer
+from .hedging import make_abortable
+from .hedging import PRIMARY
+from .metrics import pop_connect_time
+from .metrics import reset_connect_time
+from .metrics import TimedHTTPAdapter
+from .results import DocumentStatus
+from .results import ModelList
+from .results import Result
+from .results import translation_from_message
+from .results import TranslationResult
+from .routing import Router
+from .segments import split_text
+from .signer import RequestSigner
+from .signer import safe_encode  # noqa
+from .singleflight import coalesced
+from .singleflight import SingleFlight
+from .streams import CHUNK_SIZE
+from .streams import DocumentSource
+from .streams import MultipartStream
+from .watcher import PENDING_STATUSES
+from .watcher import StatusWatcher
 
 TIMEOUT = 5
+# translating a long text takes longer than the other operations
+STRING_TIMEOUT = 60
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 10
+MAX_WORKERS = POOL_MAXSIZE
+MAX_RESUMES = 3
+POLL_INTERVAL = 2
+TRANSLATION_TIMEOUT = 600
+SEGMENT_RETRIES = 2
+# idempotent operations that can share a request between concurrent calls
+COALESCABLE_OPERATIONS = (
+    "hello",
+    "download",
+    "get_document_properties",
+    "get_document_status",
+    "get_document_id",
+    "models",
+    "translate_string",
+)
+# operation name of the requests that fetch translated documents
+DOCUMENT_OPERATION = "document"
+
+
+def _body_length(body):
+    if body is None:
+        return 0
+    length = getattr(body, "len", None)
+    if length is not None:
+        return length
+    try:
+        return len(body)
+    except TypeError:
+        return 0
+
+
+def _close_response(future):
+    """release the connection of a response nobody is going to read"""
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def iter_parallel(function, arguments, max_workers):
+    """call function with each tuple of arguments using max_workers threads,
+    yielding (index, result) pairs as each call finishes
+    """
+    arguments = enumerate(arguments)
+    executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+    pending = {}
+
+    def submit(count):
+        for index, args in itertools.islice(arguments, count):
+            pending[executor.submit(function, *args)] = index
+
+    try:
+        # keep a bounded queue so huge batches are not loaded at once
+        submit(max_workers * 2)
+        while pending:
+            done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future.result()
+            submit(len(done))
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
 
 
-def safe_encode(value):
-    if isinstance(value, six.text_type):
-        return value.encode("utf-8")
-    else:
-        return value
+def iter_destinations(paths, output_dir):
+    """yield (path, destination) pairs saving each path in output_dir with
+    its name, adding a number to the names already used by earlier paths
+    """
+    used = set()
+    for path in paths:
+        name = os.path.basename(path)
+        root, extension = os.path.splitext(name)
+        number = 1
+        while name in used:
+            number += 1
+            name = "{} ({}){}".format(root, number, extension)
+        used.add(name)
+        yield path, os.path.join(output_dir, name)
 
 
-class TGateClient(object):
+class BaseTGateClient(object):
+    """request signing and result parsing shared by the sync and the
+    async clients
+    """
+
     def __init__(self, url, username, password):
         self.base_url = url
         self.username = username
         self.password = password
+        self.signer = RequestSigner(username, password)
 
     def _build_headers(self, operation, *args):
-        now = datetime.datetime.utcnow()
-        timestamp = now.strftime("%Y-%m-%dT%H:%M:%SZ")
-        arguments = "".join(args)
-        datastring = "{}{}{}".format(timestamp, arguments, operation)
-        data = hmac.new(
-            safe_encode(self.password), six.b(datastring), hashlib.sha512
-        ).hexdigest()
-        headers = {"client": self.username, "timestamp": timestamp, "data": data}
-        return headers
+        return self.signer.sign(operation, *args)
 
     def _build_url(self, operation):
         return self.base_url + operation
 
+    def _get_translation_from_result(self, text):
+        return translation_from_message(text)
+
+
+class TGateClient(BaseTGateClient):
+    def __init__(
+        self,
+        url,
+        username,
+        password,
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        pool_block=False,
+        keep_alive=True,
+        cache=None,
+        metrics=None,
+        coalesce=(),
+        upload_index=None,
+        limits=None,
+        hedging=None,
+        typed_results=False,
+        compression=None,
+        router=None,
+        memory=None,
+        retry=None,
+    ):
+        """url is the address of the server, or a list of addresses of servers
+        to route the requests to with a default tgateclient.routing.Router.
+        router is a configured Router to use instead.
+
+        pool_connections is the number of per-host pools kept around,
+        pool_maxsize the number of connections kept open to each host and
+        pool_block whether to wait for a free connection instead of opening
+        a new one when pool_maxsize is reached.
+
+        cache is an optional tgateclient.cache.TranslationCache used by
+        translate_string, memory an optional
+        tgateclient.memory.TranslationMemory where it looks for translations
+        of similar texts, and metrics an optional
+        tgateclient.metrics.MetricsCollector that records every request.
+
+        coalesce is a list of method names, from COALESCABLE_OPERATIONS, whose
+        identical concurrent calls share a single request, and upload_index
+        an optional tgateclient.dedup.UploadIndex used to avoid uploading the
+        same document twice.
+
+        limits is an optional tgateclient.limits.ConcurrencyLimits that adapts
+        the number of requests in flight to the capacity of the server, and
+        hedging an optional tgateclient.hedging.HedgePolicy that sends a
+        second copy of slow idempotent requests.
+
+        typed_results=True returns tgateclient.results objects, decoded on
+        first use, instead of dicts, and compression an optional
+        tgateclient.compression.Compression to compress large request bodies.
+
+        retry is an optional tgateclient.retry.RetryPolicy that repeats the
+        failed requests of the operations that are safe to repeat.
+        """
+        if router is None and not isinstance(url, six.string_types):
+            router = Router(url)
+        if router is not None:
+            url = router.endpoints[0].url
+        super(TGateClient, self).__init__(url, username, password)
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+        self.cache = cache
+        self.memory = memory
+        self.metrics = metrics
+        unsafe = set(coalesce) - set(COALESCABLE_OPERATIONS)
+        if unsafe:
+            raise ValueError(
+                "These operations can not be coalesced: {}".format(
+                    ", ".join(sorted(unsafe))
+                )
+            )
+        self.coalesce = frozenset(coalesce)
+        self.upload_index = upload_index
+        self.limits = limits
+        self.hedging = hedging
+        self.typed_results = typed_results
+        self.compression = compression
+        self.router = router
+        self.retry = retry
+        self._hedge_executor = None
+        self._hedge_timer = None
+        self._singleflight = SingleFlight()
+        self._local = threading.local()
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._watcher = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _build_session(self):
+        session = requests.Session()
+        if self.metrics is not None:
+            adapter_class = TimedHTTPAdapter
+        else:
+            adapter_class = requests.adapters.HTTPAdapter
+        adapter = adapter_class(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block,
+        )
+        if self.hedging is not None:
+            make_abortable(adapter)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if not self.keep_alive:
+            session.headers["Connection"] = "close"
+        return session
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    self._session = self._build_session()
+        return self._session
+
+    @property
+    def watcher(self):
+        """StatusWatcher shared by all the documents translated with this
+        client
+        """
+        if self._watcher is None:
+            with self._session_lock:
+                if self._watcher is None:
+                    self._watcher = StatusWatcher(self)
+        return self._watcher
+
+    def close(self):
+        """close all pooled connections and stop watching documents. The
+        client can still be used afterwards, a new pool will be created on
+        the next request
+        """
+        with self._session_lock:
+            session, self._session = self._session, None
+            watcher, self._watcher = self._watcher, None
+            hedge_executor, self._hedge_executor = self._hedge_executor, None
+            hedge_timer, self._hedge_timer = self._hedge_timer, None
+        if watcher is not None:
+            watcher.stop()
+        if hedge_timer is not None:
+            hedge_timer.stop()
+        if hedge_executor is not None:
+            hedge_executor.shutdown(wait=False)
+        if self.router is not None:
+            self.router.stop_probing()
+        if session is not None:
+            session.close()
+
+    def _build_headers(self, operation, *args):
+        if self.metrics is None:
+            return self.signer.sign(operation, *args)
+        start = time.time()
+        headers = self.signer.sign(operation, *args)
+        self._local.sign_time = time.time() - start
+        return headers
+
+    def _signed_request(self, operation, method, url, sign_args=(), **kwargs):
+        """sign the request with operation and sign_args and send it, again
+        if it fails and self.retry allows it. Every attempt is signed anew so
+        its timestamp is current
+        """
+        policy = self.retry
+        if policy is None or operation not in policy.operations:
+            headers = self._build_headers(operation, *sign_args)
+            return self._request(operation, method, url, headers=headers, **kwargs)
+
+        policy.start_request()
+        attempt = 0
+        while True:
+            headers = self._build_headers(operation, *sign_args)
+            try:
+                response = self._request(
+                    operation, method, url, headers=headers, **kwargs
+                )
+            except Exception as e:
+                delay = policy.retry_exception(attempt, e)
+                if delay is None:
+                    raise
+            else:
+                delay = policy.retry_response(attempt, response)
+                if delay is None:
+                    return response
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def _request(self, operation, method, url, document_id=None, **kwargs):
+        """document_id is the document the request is about, so it is sent to
+        the server holding it when there are several
+        """
+        router = self.router
+        # document urls given by the server already point to the right one
+        if router is None or operation == DOCUMENT_OPERATION:
+            return self._compressed_request(operation, method, url, **kwargs)
+        router.start_probing(self._probe)
+        endpoint = router.acquire(document_id)
+        url = endpoint.url + url[len(self.base_url):]
+        ok = False
+        start = time.time()
+        try:
+            response = self._compressed_request(operation, method, url, **kwargs)
+            ok = response.status_code < 500
+        finally:
+            router.release(endpoint, time.time() - start, ok)
+        self._local.endpoint = endpoint
+        return response
+
+    def _probe(self, endpoint):
+        response = self.session.get(endpoint.url + "test/hello", timeout=TIMEOUT)
+        return response.status_code == 200
+
+    def _pin(self, result):
+        """send the later requests about the document of result to the server
+        that answered it
+        """
+        if self.router is not None and result.get("status") == "success":
+            self.router.pin(result["data"]["id"], self._local.endpoint)
+
+    def _endpoint_url(self):
+        """url of the server that answered the last request of this thread
+        when there are several
+        """
+        if self.router is None:
+            return None
+        return self._local.endpoint.url
+
+    def _compressed_request(self, operation, method, url, **kwargs):
+        compression = self.compression
+        if compression is None:
+            return self._route(operation, method, url, **kwargs)
+        encoded = compression.encode_json(kwargs)
+        response = self._route(operation, method, url, **(encoded or kwargs))
+        compression.learn(response)
+        if encoded is not None and response.status_code == 415:
+            # the server stopped accepting compressed bodies
+            response = self._route(operation, method, url, **kwargs)
+            compression.learn(response)
+        if not kwargs.get("stream"):
+            size = len(response.content)
+            compression.count_response(size, wire_size(response, size))
+        return response
+
+    def _route(self, operation, method, url, **kwargs):
+        if self.hedging is not None and operation in self.hedging.operations:
+            return self._hedged_request(operation, method, url, **kwargs)
+        return self._dispatch(operation, method, url, **kwargs)
+
+    def _dispatch(self, operation, method, url, **kwargs):
+        if self.limits is not None:
+            return self._limited_request(operation, method, url, **kwargs)
+        return self._send(operation, method, url, **kwargs)
+
+    def _hedged_request(self, operation, method, url, **kwargs):
+        policy = self.hedging
+        if self._hedge_timer is None:
+            with self._session_lock:
+                if self._hedge_timer is None:
+                    self._hedge_executor = futures.ThreadPoolExecutor(
+                        max_workers=policy.max_workers
+                    )
+                    self._hedge_timer = HedgeTimer()
+        policy.start_request()
+        request = HedgedRequest()
+        start = time.time()
+        self._hedge_timer.schedule(
+            policy.delay(operation),
+            self._start_hedge,
+            self._hedge_executor,
+            request,
+            operation,
+            method,
+            url,
+            kwargs,
+        )
+        try:
+            with request:
+                response = self._dispatch(operation, method, url, **kwargs)
+        except Exception:
+            exc_info = sys.exc_info()
+            hedge = request.finish()
+            if request.winner == HEDGE:
+                # aborted, it took at least this long
+                policy.record(operation, time.time() - start)
+                return hedge.result()
+            if hedge is None:
+                six.reraise(*exc_info)
+            # a failed copy only loses when the other one may still succeed
+            try:
+                return hedge.result()
+            except Exception:
+                six.reraise(*exc_info)
+
+        hedge = request.finish()
+        # only the first copy, so hedging does not hide slow answers
+        policy.record(operation, time.time() - start)
+        if request.claim(PRIMARY):
+            if hedge is not None:
+                hedge.add_done_callback(_close_response)
+            return response
+        response.close()
+        return hedge.result()
+
+    def _start_hedge(self, executor, request, operation, method, url, kwargs):
+        if request.done or not self.hedging.allow_hedge():
+            return
+        try:
+            request.start_hedge(
+                lambda: executor.submit(
+                    self._send_hedge, request, operation, method, url, kwargs
+                )
+            )
+        except RuntimeError:
+            # the client was closed
+            pass
+
+    def _send_hedge(self, request, operation, method, url, kwargs):
+        response = self._dispatch_signed(0, operation, method, url, **kwargs)
+        if request.claim(HEDGE):
+            request.abort()
+        return response
+
+    def _dispatch_signed(self, sign_time, operation, method, url, **kwargs):
+        self._local.sign_time = sign_time
+        return self._dispatch(operation, method, url, **kwargs)
+
+    def _send(self, operation, method, url, **kwargs):
+        if self.metrics is not None:
+            return self._measured_request(operation, method, url, **kwargs)
+        response = self.session.request(method, url, **kwargs)
+        self.signer.update_clock(response.headers.get("Date"))
+        return response
+
+    def _limited_request(self, operation, method, url, **kwargs):
+        limiter = self.limits.limiter_for(operation)
+        limiter.acquire()
+        start = time.time()
+        try:
+            response = self._send(operation, method, url, **kwargs)
+        except Exception:
+            limiter.release(time.time() - start, None, operation)
+            raise
+        latency = time.time() - start
+        release_conn = getattr(response.raw, "release_conn", None)
+        if not kwargs.get("stream") or release_conn is None:
+            limiter.release(latency, response.status_code, operation)
+            return response
+
+        # a streamed body keeps the request in flight until it is read to the
+        # end or the response is closed, both release the connection
+        pending = [True]
+
+        def release():
+            try:
+                release_conn()
+            finally:
+                if pending:
+                    pending.pop()
+                    limiter.release(latency, response.status_code, operation)
+
+        response.raw.release_conn = release
+        return response
+
+    def _measured_request(self, operation, method, url, **kwargs):
+        sign_time = getattr(self._local, "sign_time", 0)
+        self._local.sign_time = 0
+        reset_connect_time()
+        start = time.time()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except Exception:
+            total = time.time() - start
+            phases = {"sign": sign_time, "connect": pop_connect_time(), "total": total}
+            self.metrics.record(operation, phases, 0, 0, None)
+            raise
+        total = time.time() - start
+        self.signer.update_clock(response.headers.get("Date"))
+        connect = pop_connect_time()
+        headers_time = response.elapsed.total_seconds()
+        phases = {
+            "sign": sign_time,
+            "connect": connect,
+            "wait": max(headers_time - connect, 0),
+            "transfer": max(total - headers_time, 0),
+            "total": total + sign_time,
+        }
+        request_bytes = _body_length(response.request.body)
+        if kwargs.get("stream"):
+            # the body has not been read yet
+            response_bytes = int(response.headers.get("Content-Length") or 0)
+        else:
+            response_bytes = len(response.content)
+        self.metrics.record(
+            operation, phases, request_bytes, response_bytes, response.status_code
+        )
+        return response
+
+    def _result(self, result_class, response):
+        return self._typed(result_class.from_response(response))
+
+    def _typed(self, result):
+        """result itself with typed_results, otherwise its plain dict"""
+        if self.typed_results:
+            return result
+        return result.to_dict()
+
+    @coalesced
     def hello(self):
         operation = "test/hello"
         url = self._build_url(operation)
-        response = requests.get(url)
+        response = self._request(operation, "GET", url)
         if response.status_code == 200:
             return response.content
         else:
             return {}
 
-    def upload(self, filename):
+    def upload(
+        self,
+        document,
+        filename=None,
+        chunk_size=CHUNK_SIZE,
+        use_mmap=False,
+        progress=None,
+        use_index=True,
+    ):
+        """upload a document, streaming it chunk_size bytes at a time.
+
+        document can be a path, a file opened in binary mode or a
+        bytes/memoryview object. filename is required for bytes and for files
+        without a name. Files opened here are always closed, files passed in
+        are left open.
+
+        use_mmap reads the document through a memory map and progress, if
+        given, is called with (bytes_sent, total_bytes) after each chunk.
+
+        When the client has an upload_index, documents already uploaded with
+        the same contents and filename are not sent again, and the response
+        has "reused" in its data. use_index=False skips the index.
+        """
         operation = "translate/upload"
         url = self._build_url(operation)
-        headers = self._build_headers(operation, os.path.basename(filename))
-        files = {
-            "file": (
-                os.path.basename(filename),
-                open(filename, "rb"),
-                "application/octet-stream",
+        index = self.upload_index if use_index else None
+        digest = None
+        with DocumentSource(document, filename, use_mmap=use_mmap) as source:
+            if index is not None:
+                digest = source.digest(chunk_size)
+                if digest is not None:
+                    result = self._reuse_upload(index, digest, source.filename)
+                    if result is not None:
+                        return result
+            response, compressed = self._post_document(
+                operation, url, source, chunk_size, progress, self.compression
             )
-        }
-        response = requests.post(url, files=files, headers=headers)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {}
+            if compressed and response.status_code == 415 and source.restart():
+                # the server stopped accepting compressed bodies
+                response, _ = self._post_document(
+                    operation, url, source, chunk_size, progress, None
+                )
+        result = self._result(Result, response)
+        self._pin(result)
+        if digest is not None and result.get("status") == "success":
+            index.add(
+                digest, source.filename, result["data"]["id"], self._endpoint_url()
+            )
+        return result
+
+    def _post_document(self, operation, url, source, chunk_size, progress, compression):
+        """returns the response and whether the body was compressed"""
+        headers = self._build_headers(operation, source.filename)
+        body = MultipartStream("file", source, chunk_size=chunk_size, progress=progress)
+        headers["Content-Type"] = body.content_type
+        if compression is not None:
+            compressed = compression.encode_stream(body, source.filename, body.len)
+            if compressed is not None:
+                headers["Content-Encoding"] = compressed.encoding
+                body = compressed
+        response = self._request(operation, "POST", url, data=body, headers=headers)
+        return response, "Content-Encoding" in headers
 
+    def _reuse_upload(self, index, digest, filename):
+        entry = index.get(digest, filename)
+        if entry is None:
+            return None
+        document_id, needs_validation, endpoint = entry
+        if self.router is not None and not (
+            endpoint and self.router.pin_url(document_id, endpoint)
+        ):
+            # we do not know which of the servers holds it
+            index.discard(document_id)
+            return None
+        if needs_validation:
+            try:
+                response = self.get_document_properties(document_id)
+            except requests.exceptions.ConnectionError:
+                if self.router is None:
+                    raise
+                # the server holding it is down, upload it to another one
+                self.router.unpin(document_id)
+                return None
+            if response.get("status") != "success":
+                index.discard(document_id)
+                if self.router is not None:
+                    self.router.unpin(document_id)
+                return None
+            index.validated(document_id)
+        data = {"id": document_id, "reused": True}
+        return self._typed(Result(data={"status": "success", "data": data}))
+
+    @coalesced
     def download(self, document_id):
         operation = "translate/download"
         url = self._build_url(operation)
-        headers = self._build_headers(operation, document_id)
         json = {"id": document_id}
-        response = requests.post(url, json=json, headers=headers, timeout=TIMEOUT)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {}
+        response = self._signed_request(
+            operation,
+            "POST",
+            url,
+            json=json,
+            sign_args=(document_id,),
+            timeout=TIMEOUT,
+            document_id=document_id,
+        )
+        return self._result(Result, response)
 
     def download_document(self, document_id):
         response = self.download(document_id)
         if response.get("status") == "success":
             document_url = response.get("data", {}).get("id", "")
             if document_url.startswith("http"):
-                data = requests.get(document_url)
+                data = self._request(DOCUMENT_OPERATION, "GET", document_url)
                 return {"status": "success", "data": {"contents": data.content}}
 
+    def download_document_to(
+        self, document_id, destination, chunk_size=CHUNK_SIZE, max_resumes=MAX_RESUMES
+    ):
+        """stream the translated document to destination, a path or a file
+        opened for binary writing, without holding it in memory.
+
+        If the connection drops and the server accepts ranges, the transfer
+        is resumed from where it stopped up to max_resumes times. Returns
+        the size and content type of the document instead of its contents.
+        """
+        response = self.download(document_id)
+        if response.get("status") != "success":
+            return response
+        document_url = response.get("data", {}).get("id", "")
+        if not document_url.startswith("http"):
+            return {"status": "error", "data": {"message": "no document url"}}
+
+        if isinstance(destination, six.string_types):
+            fp = open(destination, "wb")
+            try:
+                with fp:
+                    result = self._stream_to(document_url, fp, chunk_size, max_resumes)
+            except Exception:
+                os.remove(destination)
+                raise
+            if result["status"] != "success":
+                os.remove(destination)
+            else:
+                result["data"]["path"] = destination
+            return result
+        return self._stream_to(document_url, destination, chunk_size, max_resumes)
+
+    def _stream_to(self, url, fp, chunk_size, max_resumes):
+        try:
+            start = fp.tell()
+        except (AttributeError, IOError, OSError):
+            start = None
+        written = 0
+        resumes = 0
+        expected = None
+        can_resume = False
+        content_type = None
+        while True:
+            headers = {}
+            if written:
+                headers["Range"] = "bytes={}-".format(written)
+            try:
+                response = self._request(
+                    DOCUMENT_OPERATION,
+                    "GET",
+                    url,
+                    headers=headers,
+                    stream=True,
+                    timeout=TIMEOUT,
+                )
+                with contextlib.closing(response):
+                    if response.status_code not in (200, 206):
+                        return {
+                            "status": "error",
+                            "data": {"message": "HTTP {}".format(response.status_code)},
+                        }
+                    range_start = self._range_start(response)
+                    if range_start != written:
+                        # the range was ignored or is not the one asked for
+                        if start is None or (
+                            range_start != 0 and resumes >= max_resumes
+                        ):
+                            return {
+                                "status": "error",
+                                "data": {"message": "cannot resume the download"},
+                            }
+                        fp.seek(start)
+                        fp.truncate()
+                        written = 0
+                        if range_start != 0:
+                            # ask for the whole document again
+                            resumes += 1
+                            continue
+                    if not written:
+                        content_type = response.headers.get("Content-Type")
+                        can_resume = (
+                            response.headers.get("Accept-Ranges") == "bytes"
+                            and "Content-Encoding" not in response.headers
+                        )
+                        expected = self._expected_length(response)
+                    received = 0
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        fp.write(chunk)
+                        # counted as it is written, a resume starts after it
+                        received += len(chunk)
+                        written += len(chunk)
+                    self._count_download(response, received)
+                break
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.Timeout,
+            ) as e:
+                if not can_resume or resumes >= max_resumes:
+                    return {"status": "error", "data": {"message": str(e)}}
+                resumes += 1
+
+        if expected is not None and written != expected:
+            return {
+                "status": "error",
+                "data": {
+                    "message": "expected {} bytes, got {}".format(expected, written)
+                },
+            }
+        return {
+            "status": "success",
+            "data": {"size": written, "content_type": content_type, "resumes": resumes},
+        }
+
+    def _count_download(self, response, size):
+        if self.compression is not None:
+            self.compression.count_response(size, wire_size(response, size))
+
+    def _range_start(self, response):
+        """first byte of the document in the body of response, None if its
+        Content-Range is not valid
+        """
+        if response.status_code != 206:
+            return 0
+        match = re.match(r"bytes (\d+)-", response.headers.get("Content-Range", ""))
+        return int(match.group(1)) if match else None
+
+    def _expected_length(self, response):
+        if "Content-Encoding" in response.headers:
+            return None
+        content_range = response.headers.get("Content-Range", "")
+        if "/" in content_range:
+            total = content_range.rsplit("/", 1)[1]
+            return int(total) if total.isdigit() else None
+        length = response.headers.get("Content-Length", "")
+        return int(length) if length.isdigit() else None
+
     def remove(self, document_id):
         operation = "translate/remove_document"
         url = self._build_url(operation)
-        headers = self._build_headers(operation, document_id)
         json = {"id": document_id}
-        response = requests.post(url, json=json, headers=headers, timeout=TIMEOUT)
+        response = self._signed_request(
+            operation,
+            "POST",
+            url,
+            json=json,
+            sign_args=(document_id,),
+            timeout=TIMEOUT,
+            document_id=document_id,
+        )
+        if self.upload_index is not None:
+            self.upload_index.discard(document_id)
+        if self.router is not None:
+            self.router.unpin(document_id)
 
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {}
+        return self._result(Result, response)
 
+    @coalesced
     def get_document_properties(self, document_id):
         operation = "translate/properties"
         url = self._build_url(operation)
-        headers = self._build_headers(operation, document_id)
         json = {"id": document_id}
-        response = requests.post(url, json=json, headers=headers, timeout=TIMEOUT)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {}
+        response = self._signed_request(
+            operation,
+            "POST",
+            url,
+            json=json,
+            sign_args=(document_id,),
+            timeout=TIMEOUT,
+            document_id=document_id,
+        )
+        return self._result(Result, response)
 
+    @coalesced
     def get_document_status(self, document_id):
         operation = "translate/status"
         url = self._build_url(operation)
-        headers = self._build_headers(operation, document_id)
         json = {"id": document_id}
-        response = requests.post(url, json=json, headers=headers, timeout=TIMEOUT)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {}
+        response = self._signed_request(
+            operation,
+            "POST",
+            url,
+            json=json,
+            sign_args=(document_id,),
+            timeout=TIMEOUT,
+            document_id=document_id,
+        )
+        return self._result(DocumentStatus, response)
 
+    @coalesced
     def get_document_id(self, filename):
         operation = "translate/document_id"
         url = self._build_url(operation)
-        headers = self._build_headers(operation, filename)
         json = {"filename": filename}
-        response = requests.post(url, json=json, headers=headers, timeout=TIMEOUT)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {}
+        response = self._signed_request(
+            operation,
+            "POST",
+            url,
+            json=json,
+            sign_args=(filename,),
+            timeout=TIMEOUT,
+        )
+        result = self._result(Result, response)
+        self._pin(result)
+        return result
 
+    @coalesced
     def models(self):
         operation = "translate/models"
         url = self._build_url(operation)
-        headers = self._build_headers(operation)
-        response = requests.get(url, headers=headers, timeout=TIMEOUT)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {}
+        response = self._signed_request(operation, "GET", url, timeout=TIMEOUT)
+        return self._result(ModelList, response)
 
     def translate_document(self, document_id, model_id, tr_mode):
         operation = "translate/translate_document"
         url = self._build_url(operation)
-        headers = self._build_headers(operation, document_id, model_id)
         json = {"document_id": document_id, "model_id": model_id, "tr_mode": tr_mode}
-        response = requests.post(url, json=json, headers=headers, timeout=TIMEOUT)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {}
+        response = self._signed_request(
+            operation,
+            "POST",
+            url,
+            json=json,
+            sign_args=(document_id, model_id),
+            timeout=TIMEOUT,
+            document_id=document_id,
+        )
+        return self._result(Result, response)
+
+    @coalesced
+    def translate_string(
+        self,
+        text,
+        model_id,
+        tr_mode,
+        mime_type,
+        use_cache=True,
+        max_segment_size=None,
+        max_workers=MAX_WORKERS,
+        segment_retries=SEGMENT_RETRIES,
+        use_memory=True,
+    ):
+        """use_cache=False skips the translation cache, if any, and
+        use_memory=False the translation memory.
+
+        Translations found in the memory have the score of the match, from 0
+        to 1, as "match" in their data, and the source text they translate as
+        "source".
+
+        Texts longer than max_segment_size characters, if given, are split in
+        segments at paragraph or sentence boundaries without cutting HTML
+        tags, translated with max_workers parallel requests and joined back.
+        Only the failed segments are retried, up to segment_retries times.
+        """
+        if max_segment_size is not None and len(text) > max_segment_size:
+            return self._translate_segments(
+                text,
+                model_id,
+                tr_mode,
+                mime_type,
+                use_cache,
+                max_segment_size,
+                max_workers,
+                segment_retries,
+                use_memory,
+            )
+
+        cache = self.cache if use_cache else None
+        if cache is not None:
+            key = cache.key(text, model_id, tr_mode, mime_type)
+            result = cache.get(key)
+            if result is not None:
+                return self._typed(TranslationResult(data=result))
+
+        memory = self.memory if use_memory else None
+        if memory is not None:
+            match = memory.lookup(text, model_id, tr_mode, mime_type)
+            if match is not None:
+                score, translation, source = match
+                data = {"translation": translation, "match": score, "source": source}
+                return self._typed(
+                    TranslationResult(data={"status": "success", "data": data})
+                )
 
-    def translate_string(self, text, model_id, tr_mode, mime_type):
         operation = "translate/translate_string"
         url = self._build_url(operation)
-        headers = self._build_headers(operation, text, model_id, mime_type)
         json = {
             "text": text,
             "model_id": model_id,
             "tr_mode": tr_mode,
             "mime": mime_type,
         }
-        response = requests.post(url, json=json, headers=headers)
-        if response.status_code == 200:
-            result = response.json()
-            if result["status"] == "success":
-                result["data"]["translation"] = self._get_translation_from_result(
-                    result["data"]["message"]
+        response = self._signed_request(
+            operation,
+            "POST",
+            url,
+            json=json,
+            sign_args=(text, model_id, mime_type),
+            timeout=STRING_TIMEOUT,
+        )
+        result = TranslationResult.from_response(response)
+        if result.ok:
+            if cache is not None:
+                cache.set(key, result.to_dict())
+            if memory is not None:
+                memory.add(text, result.translation, model_id, tr_mode, mime_type)
+        return self._typed(result)
+
+    def _translate_segments(
+        self,
+        text,
+        model_id,
+        tr_mode,
+        mime_type,
+        use_cache,
+        max_segment_size,
+        max_workers,
+        segment_retries,
+        use_memory,
+    ):
+        segments = split_text(text, mime_type, max_segment_size)
+        translations = {}
+        pending = [index for index, segment in enumerate(segments) if segment[1]]
+        for _ in range(segment_retries + 1):
+            arguments = [
+                (
+                    segments[index][1],
+                    model_id,
+                    tr_mode,
+                    mime_type,
+                    use_cache,
+                    use_memory,
                 )
+                for index in pending
+            ]
+            failed = []
+            for index, result in iter_parallel(
+                self._safe_translate_string, arguments, max_workers
+            ):
+                if result.get("status") == "success":
+                    translations[pending[index]] = result["data"]["translation"]
+                else:
+                    failed.append(pending[index])
+            pending = sorted(failed)
+            if not pending:
+                break
 
-            return result
-        else:
-            return {}
+        if pending:
+            return self._typed(
+                TranslationResult(
+                    data={
+                        "status": "error",
+                        "data": {
+                            "message": "{} of {} segments failed".format(
+                                len(pending), len(segments)
+                            ),
+                            "failed_segments": pending,
+                        },
+                    }
+                )
+            )
+        translation = u"".join(
+            prefix + translations.get(index, u"") + suffix
+            for index, (prefix, _, suffix) in enumerate(segments)
+        )
+        return self._typed(
+            TranslationResult(
+                data={
+                    "status": "success",
+                    "data": {"translation": translation, "segments": len(segments)},
+                }
+            )
+        )
 
-    def _get_translation_from_result(self, text):
-        """translated text is inside the variable text, after the words 'target text:'
+    def _safe_translate_string(
+        self, text, model_id, tr_mode, mime_type, use_cache=True, use_memory=True
+    ):
+        try:
+            return self.translate_string(
+                text,
+                model_id,
+                tr_mode,
+                mime_type,
+                use_cache=use_cache,
+                use_memory=use_memory,
+            )
+        except Exception as e:
+            return {"status": "error", "data": {"message": str(e)}}
+
+    def iter_translate_strings(
+        self, texts, model_id, tr_mode, mime_type, max_workers=MAX_WORKERS
+    ):
+        """translate texts using max_workers parallel requests, yielding
+        (index, result) pairs as soon as each translation finishes.
+
+        A failing text does not stop the batch: its result is the error
+        returned by the server, or an error dict with the exception message.
+        """
+        for index, result in iter_parallel(
+            self._safe_translate_string,
+            ((text, model_id, tr_mode, mime_type) for text in texts),
+            max_workers,
+        ):
+            yield index, result
+
+    def translate_strings(
+        self, texts, model_id, tr_mode, mime_type, max_workers=MAX_WORKERS
+    ):
+        """translate texts in parallel and return their results in the same
+        order. See iter_translate_strings
+        """
+        results = {}
+        for index, result in self.iter_translate_strings(
+            texts, model_id, tr_mode, mime_type, max_workers=max_workers
+        ):
+            results[index] = result
+        return [results[index] for index in range(len(results))]
+
+    def translate_file(
+        self,
+        path,
+        model_id,
+        tr_mode,
+        destination,
+        timeout=TRANSLATION_TIMEOUT,
+    ):
+        """upload, translate and download a single document, removing it from
+        the server afterwards whatever happens. The translation status is
+        followed by self.watcher
+        """
+        document_id = None
+        try:
+            response = self.upload(path)
+            document_id = response.get("data", {}).get("id")
+            if response.get("status") != "success" or not document_id:
+                return self._file_result(path, destination, document_id, response)
+
+            response = self.translate_document(document_id, model_id, tr_mode)
+            if response.get("status") != "success":
+                return self._file_result(path, destination, document_id, response)
+
+            try:
+                response = self.watcher.watch(document_id).result(timeout)
+            finally:
+                self.watcher.unwatch(document_id)
+            if response.get("status") != "success":
+                return self._file_result(path, destination, document_id, response)
+
+            response = self.download_document_to(document_id, destination)
+            return self._file_result(path, destination, document_id, response)
+        except Exception as e:
+            response = {"status": "error", "data": {"message": str(e)}}
+            return self._file_result(path, destination, document_id, response)
+        finally:
+            if document_id:
+                try:
+                    self.remove(document_id)
+                except requests.exceptions.RequestException:
+                    pass
+
+    def _file_result(self, path, destination, document_id, response):
+        data = dict(response.get("data") or {})
+        data.update(
+            {"path": path, "destination": destination, "document_id": document_id}
+        )
+        return {"status": response.get("status") or "error", "data": data}
+
+    def wait_for_document(
+        self, document_id, poll_interval=POLL_INTERVAL, timeout=TRANSLATION_TIMEOUT
+    ):
+        """poll get_document_status until the document is no longer being
+        translated, returning the last status response
+        """
+        deadline = time.time() + timeout
+        while True:
+            response = self.get_document_status(document_id)
+            if response.get("status") != "success":
+                return response
+            if response.get("data", {}).get("id") not in PENDING_STATUSES:
+                return response
+            if time.time() + poll_interval > deadline:
+                return {
+                    "status": "error",
+                    "data": {"message": "timeout waiting for the translation"},
+                }
+            time.sleep(poll_interval)
+
+    def translate_files(
+        self,
+        paths,
+        model_id,
+        tr_mode,
+        output_dir,
+        concurrency=MAX_WORKERS,
+        timeout=TRANSLATION_TIMEOUT,
+    ):
+        """translate many documents, keeping up to concurrency of them in
+        flight so uploads, translations and downloads overlap.
+
+        Translations are saved in output_dir with the same name as the
+        original file, numbered when several files have the same name, e.g.
+        "report (2).docx". Yields one result per document as soon as it finishes.
         """
-        _, translation = text.split("target text:")
-        return translation
+        arguments = (
+            (path, model_id, tr_mode, destination, timeout)
+            for path, destination in iter_destinations(paths, output_dir)
+        )
+        for _, result in iter_parallel(self.translate_file, arguments, concurrency):
+            yield result
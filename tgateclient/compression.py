@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""Negotiated compression of request bodies.
+
+The server announces the encodings it accepts in request bodies with an
+Accept-Encoding header in its responses (RFC 7694). Responses and downloaded
+documents are decompressed as they are read by requests, which already asks
+for gzip and deflate.
+"""
+import json
+import os
+import threading
+import zlib
+
+GZIP = "gzip"
+DEFLATE = "deflate"
+ENCODINGS = (GZIP, DEFLATE)
+MIN_SIZE = 1024
+LEVEL = 6
+# documents that are compressed already and would only waste time
+COMPRESSED_EXTENSIONS = (
+    ".docx",
+    ".xlsx",
+    ".pptx",
+    ".odt",
+    ".ods",
+    ".odp",
+    ".epub",
+    ".pdf",
+    ".zip",
+    ".gz",
+    ".jpg",
+    ".jpeg",
+    ".png",
+    ".gif",
+)
+
+
+def compressor(encoding, level=LEVEL):
+    if encoding == GZIP:
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if encoding == DEFLATE:
+        # HTTP deflate is the zlib format, not raw deflate
+        return zlib.compressobj(level)
+    raise ValueError("Unknown encoding: {}".format(encoding))
+
+
+def compress(data, encoding, level=LEVEL):
+    compressobj = compressor(encoding, level)
+    return compressobj.compress(data) + compressobj.flush()
+
+
+def decompress(data, encoding):
+    if encoding == GZIP:
+        return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+    if encoding == DEFLATE:
+        return zlib.decompress(data)
+    raise ValueError("Unknown encoding: {}".format(encoding))
+
+
+class CompressedStream(object):
+    """compresses the chunks of a streamed body as they are sent"""
+
+    def __init__(self, chunks, encoding, level=LEVEL, compression=None):
+        self.chunks = chunks
+        self.encoding = encoding
+        self.level = level
+        self.compression = compression
+
+    def __iter__(self):
+        compressobj = compressor(self.encoding, self.level)
+        size = 0
+        compressed_size = 0
+        for chunk in self.chunks:
+            size += len(chunk)
+            data = compressobj.compress(chunk)
+            if data:
+                compressed_size += len(data)
+                yield data
+        data = compressobj.flush()
+        compressed_size += len(data)
+        yield data
+        if self.compression is not None:
+            self.compression.count_request(size, compressed_size)
+
+
+class Compression(object):
+    """compresses request bodies of at least min_size bytes with the first
+    of encodings accepted by the server. Until the server announces them,
+    bodies are sent as they are unless assume_accepted is True.
+
+    Counts the bytes before and after compression of the compressed request
+    bodies and of the responses, see stats.
+    """
+
+    def __init__(
+        self,
+        min_size=MIN_SIZE,
+        level=LEVEL,
+        encodings=ENCODINGS,
+        assume_accepted=False,
+    ):
+        self.min_size = min_size
+        self.level = level
+        self.encodings = tuple(encodings)
+        self.encoding = self.encodings[0] if assume_accepted else None
+        self.request_bytes = 0
+        self.request_wire_bytes = 0
+        self.response_bytes = 0
+        self.response_wire_bytes = 0
+        self._lock = threading.Lock()
+
+    def learn(self, response):
+        """update the accepted encoding from the headers of a response"""
+        header = response.headers.get("Accept-Encoding")
+        if header is not None:
+            offered = [
+                value.split(";")[0].strip().lower() for value in header.split(",")
+            ]
+            accepted = [encoding for encoding in self.encodings if encoding in offered]
+            self.encoding = accepted[0] if accepted else None
+        elif response.status_code == 415:
+            self.encoding = None
+
+    def encode_json(self, kwargs):
+        """request kwargs with their json body compressed, or None if it is
+        not worth it
+        """
+        encoding = self.encoding
+        if encoding is None or kwargs.get("json") is None:
+            return None
+        body = json.dumps(kwargs["json"], allow_nan=False).encode("utf-8")
+        if len(body) < self.min_size:
+            return None
+        data = compress(body, encoding, self.level)
+        if len(data) >= len(body):
+            return None
+        self.count_request(len(body), len(data))
+        kwargs = dict(kwargs)
+        del kwargs["json"]
+        headers = dict(kwargs.get("headers") or {})
+        headers["Content-Type"] = "application/json"
+        headers["Content-Encoding"] = encoding
+        kwargs["headers"] = headers
+        kwargs["data"] = data
+        return kwargs
+
+    def encode_stream(self, chunks, filename, size):
+        """a CompressedStream of chunks, or None if the body of that size,
+        None if unknown, or a document like filename should not be compressed
+        """
+        encoding = self.encoding
+        if encoding is None or (size is not None and size < self.min_size):
+            return None
+        if os.path.splitext(filename or "")[1].lower() in COMPRESSED_EXTENSIONS:
+            return None
+        return CompressedStream(chunks, encoding, self.level, self)
+
+    def count_request(self, size, wire_size):
+        with self._lock:
+            self.request_bytes += size
+            self.request_wire_bytes += wire_size
+
+    def count_response(self, size, wire_size):
+        with self._lock:
+            self.response_bytes += size
+            self.response_wire_bytes += wire_size
+
+    def stats(self):
+        with self._lock:
+            return {
+                "encoding": self.encoding,
+                "request_bytes": self.request_bytes,
+                "request_wire_bytes": self.request_wire_bytes,
+                "response_bytes": self.response_bytes,
+                "response_wire_bytes": self.response_wire_bytes,
+                "saved_bytes": self.request_bytes
+                - self.request_wire_bytes
+                + self.response_bytes
+                - self.response_wire_bytes,
+            }
+
+
+def wire_size(response, size):
+    """bytes of the body of a response that were actually received"""
+    try:
+        return response.raw.tell()
+    except (AttributeError, IOError):
+        return size
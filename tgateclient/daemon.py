@@ -0,0 +1,544 @@
+# -*- coding: utf-8 -*-
+"""A local daemon that shares one warm TGateClient between many processes:
+
+    tgateclient-daemon --url https://tgate.example.com/ --cache ~/.tgate.db
+
+and in each process:
+
+    client = DaemonClient()
+    client.translate_string("Kaixo", "generic_eu2es", "MachineTranslation", "text/plain")
+
+The daemon keeps the connection pool, the translation cache and the list of
+models between the requests of short-lived processes. It listens on a Unix
+socket only the user running it can use, in $XDG_RUNTIME_DIR or a private
+directory of the temporary directory, and speaks one JSON object per line.
+DaemonClient has the methods of TGateClient and paths given to it must be
+readable or writable by the daemon.
+"""
+from __future__ import print_function
+
+from six.moves import socketserver
+
+import argparse
+import base64
+import json
+import os
+import six
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+from .cache import TranslationCache
+from .client import COALESCABLE_OPERATIONS
+from .client import iter_destinations
+from .client import iter_parallel
+from .client import MAX_RESUMES
+from .client import MAX_WORKERS
+from .client import POLL_INTERVAL
+from .client import SEGMENT_RETRIES
+from .client import TGateClient
+from .client import TRANSLATION_TIMEOUT
+from .streams import CHUNK_SIZE
+
+MODELS_TTL = 300
+# methods of TGateClient that can be called through the daemon
+METHODS = (
+    "hello",
+    "upload",
+    "download",
+    "download_document",
+    "download_document_to",
+    "remove",
+    "get_document_properties",
+    "get_document_status",
+    "get_document_id",
+    "models",
+    "translate_document",
+    "translate_string",
+    "translate_strings",
+    "translate_file",
+    "wait_for_document",
+)
+
+
+def default_socket_path():
+    """$TGATE_DAEMON_SOCKET, or a socket in $XDG_RUNTIME_DIR, or else in a
+    directory of the temporary directory that only the user can access
+    """
+    path = os.environ.get("TGATE_DAEMON_SOCKET")
+    if path:
+        return path
+    directory = os.environ.get("XDG_RUNTIME_DIR")
+    if not directory:
+        directory = os.path.join(
+            tempfile.gettempdir(), "tgateclient-{}".format(os.getuid())
+        )
+        _private_directory(directory)
+    return os.path.join(directory, "tgateclient.sock")
+
+
+def _private_directory(path):
+    """create the directory at path only readable by the user, or check that
+    it already is, so other users can not put their own socket there
+    """
+    try:
+        os.mkdir(path, 0o700)
+    except OSError:
+        if not os.path.isdir(path) or os.path.islink(path):
+            raise
+    _check_owner(path)
+    if os.stat(path).st_mode & 0o077:
+        raise RuntimeError("{} can be accessed by other users".format(path))
+
+
+def _check_owner(path):
+    if os.lstat(path).st_uid != os.getuid():
+        raise RuntimeError("{} belongs to another user".format(path))
+
+
+def _encode(value):
+    """make value JSON serializable, keeping bytes apart from text"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"__bytes__": base64.b64encode(bytes(value)).decode("ascii")}
+    if isinstance(value, dict) or hasattr(value, "to_dict"):
+        return dict((key, _encode(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if list(value) == ["__bytes__"]:
+            return base64.b64decode(value["__bytes__"])
+        return dict((key, _decode(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    return value
+
+
+def _dumps(message):
+    return json.dumps(message).encode("utf-8") + b"\n"
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        daemon = self.server.daemon
+        with daemon.lock:
+            daemon.connections += 1
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line.decode("utf-8"))
+                    result = daemon.call(
+                        request["method"],
+                        _decode(request.get("args", [])),
+                        _decode(request.get("kwargs", {})),
+                    )
+                    reply = {"result": _encode(result)}
+                except Exception as e:
+                    reply = {"error": str(e) or e.__class__.__name__}
+                self.wfile.write(_dumps(reply))
+                self.wfile.flush()
+        finally:
+            with daemon.lock:
+                daemon.connections -= 1
+
+
+class TranslationDaemon(object):
+    """serves the METHODS of client on the Unix socket at path. The models
+    list is cached for models_ttl seconds
+    """
+
+    def __init__(self, client, path=None, models_ttl=MODELS_TTL):
+        self.client = client
+        self.path = path or default_socket_path()
+        self.models_ttl = models_ttl
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._models = None
+        self._models_time = 0
+        self._server = None
+        self._thread = None
+
+    def _bind(self):
+        if os.path.exists(self.path):
+            _check_owner(self.path)
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except socket.error:
+                # left behind by a daemon that did not stop cleanly
+                os.remove(self.path)
+            else:
+                raise RuntimeError("A daemon is already listening on " + self.path)
+            finally:
+                probe.close()
+        # the socket is created only accessible by the user, there is no
+        # moment when others could connect to it
+        umask = os.umask(0o177)
+        try:
+            server = _UnixServer(self.path, _Handler)
+        finally:
+            os.umask(umask)
+        server.daemon = self
+        return server
+
+    def start(self):
+        """serve in a background thread"""
+        self._server = self._bind()
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server = self._bind()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._close()
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            self._close()
+
+    def _close(self):
+        self._server.server_close()
+        self._server = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def call(self, method, args, kwargs):
+        with self.lock:
+            self.requests += 1
+        if method == "stats":
+            return self.stats()
+        if method not in METHODS:
+            raise ValueError("Unknown method: {}".format(method))
+        if method == "models":
+            return self.models()
+        return getattr(self.client, method)(*args, **kwargs)
+
+    def models(self):
+        if self._models is None or time.time() - self._models_time > self.models_ttl:
+            result = self.client.models()
+            if result.get("status") != "success":
+                return result
+            self._models = result
+            self._models_time = time.time()
+        return self._models
+
+    def stats(self):
+        with self.lock:
+            stats = {"requests": self.requests, "connections": self.connections}
+        if self.client.cache is not None:
+            stats["cache"] = self.client.cache.stats()
+        return stats
+
+
+class DaemonClient(object):
+    """drop-in replacement of TGateClient that sends every call to the
+    TranslationDaemon listening at path. timeout is the number of seconds to
+    wait for each answer, None to wait as long as needed
+    """
+
+    def __init__(self, path=None, timeout=None):
+        self.path = path or default_socket_path()
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _connect(self):
+        # a socket of another user could be a daemon answering anything
+        _check_owner(self.path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except socket.error:
+            sock.close()
+            raise
+        return sock, sock.makefile("rb")
+
+    def _call(self, method, *args, **kwargs):
+        with self._lock:
+            connection = self._idle.pop() if self._idle else None
+        if connection is None:
+            connection = self._connect()
+        sock, rfile = connection
+        try:
+            request = {"method": method, "args": args, "kwargs": kwargs}
+            sock.sendall(_dumps(_encode(request)))
+            line = rfile.readline()
+        except Exception:
+            rfile.close()
+            sock.close()
+            raise
+        if not line:
+            rfile.close()
+            sock.close()
+            raise RuntimeError("The daemon closed the connection")
+        with self._lock:
+            self._idle.append(connection)
+        reply = json.loads(line.decode("utf-8"))
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        return _decode(reply["result"])
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for sock, rfile in idle:
+            rfile.close()
+            sock.close()
+
+    def stats(self):
+        return self._call("stats")
+
+    def hello(self):
+        return self._call("hello")
+
+    def upload(
+        self,
+        document,
+        filename=None,
+        chunk_size=CHUNK_SIZE,
+        use_mmap=False,
+        progress=None,
+        use_index=True,
+    ):
+        """files are read here and sent to the daemon with their contents,
+        and progress is only called once, at the end
+        """
+        if isinstance(document, six.string_types):
+            document = os.path.abspath(document)
+        elif not isinstance(document, (bytes, bytearray, memoryview)):
+            filename = filename or os.path.basename(getattr(document, "name", ""))
+            document = document.read()
+        result = self._call(
+            "upload",
+            document,
+            filename=filename,
+            chunk_size=chunk_size,
+            use_mmap=use_mmap,
+            use_index=use_index,
+        )
+        if progress is not None and not isinstance(document, six.string_types):
+            progress(len(document), len(document))
+        return result
+
+    def download(self, document_id):
+        return self._call("download", document_id)
+
+    def download_document(self, document_id):
+        return self._call("download_document", document_id)
+
+    def download_document_to(
+        self, document_id, destination, chunk_size=CHUNK_SIZE, max_resumes=MAX_RESUMES
+    ):
+        """files opened here are written with the contents of the document
+        instead of streaming it
+        """
+        if isinstance(destination, six.string_types):
+            return self._call(
+                "download_document_to",
+                document_id,
+                os.path.abspath(destination),
+                chunk_size=chunk_size,
+                max_resumes=max_resumes,
+            )
+        result = self.download_document(document_id)
+        if (result or {}).get("status") != "success":
+            return result or {"status": "error", "data": {"message": "no document"}}
+        contents = result["data"]["contents"]
+        destination.write(contents)
+        return {
+            "status": "success",
+            "data": {"size": len(contents), "content_type": None, "resumes": 0},
+        }
+
+    def remove(self, document_id):
+        return self._call("remove", document_id)
+
+    def get_document_properties(self, document_id):
+        return self._call("get_document_properties", document_id)
+
+    def get_document_status(self, document_id):
+        return self._call("get_document_status", document_id)
+
+    def get_document_id(self, filename):
+        return self._call("get_document_id", filename)
+
+    def models(self):
+        return self._call("models")
+
+    def translate_document(self, document_id, model_id, tr_mode):
+        return self._call("translate_document", document_id, model_id, tr_mode)
+
+    def translate_string(
+        self,
+        text,
+        model_id,
+        tr_mode,
+        mime_type,
+        use_cache=True,
+        max_segment_size=None,
+        max_workers=MAX_WORKERS,
+        segment_retries=SEGMENT_RETRIES,
+        use_memory=True,
+    ):
+        return self._call(
+            "translate_string",
+            text,
+            model_id,
+            tr_mode,
+            mime_type,
+            use_cache=use_cache,
+            max_segment_size=max_segment_size,
+            max_workers=max_workers,
+            segment_retries=segment_retries,
+            use_memory=use_memory,
+        )
+
+    def _safe_translate_string(self, text, model_id, tr_mode, mime_type):
+        try:
+            return self.translate_string(text, model_id, tr_mode, mime_type)
+        except Exception as e:
+            return {"status": "error", "data": {"message": str(e)}}
+
+    def iter_translate_strings(
+        self, texts, model_id, tr_mode, mime_type, max_workers=MAX_WORKERS
+    ):
+        for index, result in iter_parallel(
+            self._safe_translate_string,
+            ((text, model_id, tr_mode, mime_type) for text in texts),
+            max_workers,
+        ):
+            yield index, result
+
+    def translate_strings(
+        self, texts, model_id, tr_mode, mime_type, max_workers=MAX_WORKERS
+    ):
+        return self._call(
+            "translate_strings",
+            list(texts),
+            model_id,
+            tr_mode,
+            mime_type,
+            max_workers=max_workers,
+        )
+
+    def translate_file(
+        self, path, model_id, tr_mode, destination, timeout=TRANSLATION_TIMEOUT
+    ):
+        return self._call(
+            "translate_file",
+            os.path.abspath(path),
+            model_id,
+            tr_mode,
+            os.path.abspath(destination),
+            timeout=timeout,
+        )
+
+    def wait_for_document(
+        self, document_id, poll_interval=POLL_INTERVAL, timeout=TRANSLATION_TIMEOUT
+    ):
+        return self._call(
+            "wait_for_document",
+            document_id,
+            poll_interval=poll_interval,
+            timeout=timeout,
+        )
+
+    def translate_files(
+        self,
+        paths,
+        model_id,
+        tr_mode,
+        output_dir,
+        concurrency=MAX_WORKERS,
+        timeout=TRANSLATION_TIMEOUT,
+    ):
+        arguments = (
+            (path, model_id, tr_mode, destination, timeout)
+            for path, destination in iter_destinations(paths, output_dir)
+        )
+        for _, result in iter_parallel(self.translate_file, arguments, concurrency):
+            yield result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="\n".join(__doc__.splitlines()[1:]),
+    )
+    parser.add_argument(
+        "--socket", help="path of the Unix socket, see default_socket_path"
+    )
+    parser.add_argument("--url", default=os.environ.get("TGATE_SERVER_URL"))
+    parser.add_argument("--username", default=os.environ.get("TGATE_USERNAME"))
+    parser.add_argument("--password", default=os.environ.get("TGATE_PASSWORD"))
+    parser.add_argument("--cache", help="path of the translation cache")
+    parser.add_argument("--pool-maxsize", type=int, default=MAX_WORKERS)
+    parser.add_argument("--models-ttl", type=int, default=MODELS_TTL)
+    args = parser.parse_args(argv)
+    if not args.url:
+        parser.error("--url or TGATE_SERVER_URL is required")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    cache = TranslationCache(args.cache) if args.cache else None
+    client = TGateClient(
+        args.url,
+        args.username,
+        args.password,
+        pool_maxsize=args.pool_maxsize,
+        cache=cache,
+        coalesce=COALESCABLE_OPERATIONS,
+    )
+    daemon = TranslationDaemon(client, args.socket, models_ttl=args.models_ttl)
+    print("Listening on {}".format(daemon.path))
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+        if cache is not None:
+            cache.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
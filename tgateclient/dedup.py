@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""Local index of the documents uploaded to the server, by content"""
+import sqlite3
+import threading
+import time
+
+# seconds to trust an entry before checking the document is still on the
+# server
+VALIDATE_AFTER = 3600
+
+
+class UploadIndex(object):
+    """maps the sha256 of a document and its filename to the document_id it
+    got when it was uploaded, and the url of the server holding it when
+    requests are routed between several, stored in a SQLite database.
+
+    TGateClient.upload uses it to skip uploading documents that are already
+    on the server, checking them with get_document_properties when they have
+    not been validated for validate_after seconds.
+    """
+
+    def __init__(self, path, validate_after=VALIDATE_AFTER):
+        self.path = path
+        self.validate_after = validate_after
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS uploads "
+            "(digest TEXT, filename TEXT, document_id TEXT, validated REAL, "
+            "endpoint TEXT, PRIMARY KEY (digest, filename))"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS uploads_document_id ON uploads (document_id)"
+        )
+        self._connection.commit()
+
+    def get(self, digest, filename):
+        """returns (document_id, needs_validation, endpoint) or None"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT document_id, validated, endpoint FROM uploads "
+                "WHERE digest = ? AND filename = ?",
+                (digest, filename),
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1] < time.time() - self.validate_after, row[2]
+
+    def add(self, digest, filename, document_id, endpoint=None):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?)",
+                (digest, filename, document_id, time.time(), endpoint),
+            )
+            self._connection.commit()
+
+    def validated(self, document_id):
+        with self._lock:
+            self._connection.execute(
+                "UPDATE uploads SET validated = ? WHERE document_id = ?",
+                (time.time(), document_id),
+            )
+            self._connection.commit()
+
+    def discard(self, document_id):
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM uploads WHERE document_id = ?", (document_id,)
+            )
+            self._connection.commit()
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM uploads")
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""Hedged requests, to cut the tail latency of idempotent reads.
+
+The first copy of a request is sent from the calling thread. If it is still
+waiting for an answer after the delay of its operation, a HedgeTimer sends a
+second copy from a thread pool. When that copy is answered first it aborts
+the connection of the first one, so the calling thread can return its
+answer right away.
+"""
+import collections
+import heapq
+import itertools
+import logging
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# idempotent operations that can safely be sent twice
+HEDGEABLE_OPERATIONS = (
+    "translate/translate_string",
+    "translate/models",
+    "translate/status",
+    "translate/properties",
+    "translate/document_id",
+    "translate/download",
+)
+MAX_WORKERS = 32
+PRIMARY = "primary"
+HEDGE = "hedge"
+
+_local = threading.local()
+
+
+class HedgePolicy(object):
+    """when a request of one of operations has not been answered after the
+    given percentile of the recent latencies of that operation, the client
+    sends it again and uses whichever answer comes first.
+
+    Until min_samples latencies are known default_delay seconds are used, and
+    no more than max_hedge_rate of the requests are ever duplicated. The
+    second copies are sent by up to max_workers threads.
+    """
+
+    def __init__(
+        self,
+        percentile=95,
+        max_hedge_rate=0.05,
+        default_delay=0.5,
+        min_delay=0.005,
+        min_samples=20,
+        window=500,
+        operations=HEDGEABLE_OPERATIONS,
+        max_workers=MAX_WORKERS,
+    ):
+        self.percentile = percentile
+        self.max_hedge_rate = max_hedge_rate
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.window = window
+        self.operations = frozenset(operations)
+        self.max_workers = max_workers
+        self.requests = 0
+        self.hedges = 0
+        self._latencies = {}
+        self._delays = {}
+        self._lock = threading.Lock()
+
+    def delay(self, operation):
+        return self._delays.get(operation, self.default_delay)
+
+    def record(self, operation, latency):
+        with self._lock:
+            latencies = self._latencies.get(operation)
+            if latencies is None:
+                latencies = self._latencies[operation] = collections.deque(
+                    maxlen=self.window
+                )
+            latencies.append(latency)
+            # sorting the window on every request would be too slow
+            if len(latencies) >= self.min_samples and len(latencies) % 10 == 0:
+                ordered = sorted(latencies)
+                index = min(
+                    int(len(ordered) * self.percentile / 100.0), len(ordered) - 1
+                )
+                self._delays[operation] = max(self.min_delay, ordered[index])
+
+    def start_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def allow_hedge(self):
+        with self._lock:
+            if self.hedges + 1 > self.max_hedge_rate * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+
+class HedgedRequest(object):
+    """the first copy of a request, sent from the calling thread inside a
+    with block, that a hedge copy answered first can abort
+    """
+
+    def __init__(self):
+        self.winner = None
+        self.hedge = None
+        self._done = False
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        _local.request = self
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.request = None
+
+    def attach(self, connection):
+        with self._lock:
+            if self.winner == HEDGE:
+                raise socket.error("Answered by a hedged request")
+            self._connection = connection
+
+    def detach(self, connection):
+        with self._lock:
+            if self._connection is connection:
+                self._connection = None
+
+    def start_hedge(self, submit):
+        """call submit to send the hedge copy unless the first one finished"""
+        with self._lock:
+            if not self._done:
+                self.hedge = submit()
+
+    def finish(self):
+        """mark the first copy as finished, returns the future of the hedge
+        copy or None if it was not sent
+        """
+        with self._lock:
+            self._done = True
+            return self.hedge
+
+    @property
+    def done(self):
+        return self._done
+
+    def claim(self, copy):
+        """whether copy, PRIMARY or HEDGE, is the first one to claim it"""
+        with self._lock:
+            if self.winner is None:
+                self.winner = copy
+            return self.winner == copy
+
+    def abort(self):
+        """stop waiting for the answer of the first copy"""
+        with self._lock:
+            connection, self._connection = self._connection, None
+            sock = getattr(connection, "sock", None)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except (OSError, socket.error):
+                    pass
+
+
+class _AbortableConnectionMixin(object):
+    """lets a hedge copy abort the request of the calling thread sent on this
+    connection until its response headers arrive
+    """
+
+    def putrequest(self, *args, **kwargs):
+        request = getattr(_local, "request", None)
+        if request is not None:
+            request.attach(self)
+        return super(_AbortableConnectionMixin, self).putrequest(*args, **kwargs)
+
+    def getresponse(self, *args, **kwargs):
+        try:
+            return super(_AbortableConnectionMixin, self).getresponse(*args, **kwargs)
+        finally:
+            request = getattr(_local, "request", None)
+            if request is not None:
+                request.detach(self)
+
+
+def make_abortable(adapter):
+    """let hedge copies abort the requests sent through adapter, a requests
+    HTTPAdapter
+    """
+    manager = adapter.poolmanager
+    pool_classes = {}
+    for scheme, pool_class in manager.pool_classes_by_scheme.items():
+        connection_class = type(
+            "Abortable" + pool_class.ConnectionCls.__name__,
+            (_AbortableConnectionMixin, pool_class.ConnectionCls),
+            {},
+        )
+        pool_classes[scheme] = type(
+            "Abortable" + pool_class.__name__,
+            (pool_class,),
+            {"ConnectionCls": connection_class},
+        )
+    manager.pool_classes_by_scheme = pool_classes
+
+
+class HedgeTimer(object):
+    """calls each scheduled function after its delay from a single
+    background thread, so waiting requests do not hold pool threads
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def schedule(self, delay, function, *args):
+        with self._condition:
+            entry = (time.time() + delay, next(self._counter), function, args)
+            heapq.heappush(self._heap, entry)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="tgate-hedge")
+                self._thread.daemon = True
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and (
+                    not self._heap or self._heap[0][0] > time.time()
+                ):
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+                _, _, function, args = heapq.heappop(self._heap)
+            try:
+                function(*args)
+            except Exception:
+                logger.exception("Error sending a hedged request")
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""Crash-safe journal of batch document translations:
+
+    journal = Journal("translations.db")
+    for path in paths:
+        journal.add(path, destination_for(path), "generic_es2en", "MachineTranslation")
+    for result in journal.resume(client, concurrency=8):
+        ...
+
+Every step of every document is committed to a SQLite database before the
+next one starts, so calling resume again after a crash continues each
+document from its last finished step. With a client routing between several
+servers, the one holding each document is recorded too.
+"""
+import sqlite3
+import threading
+import time
+
+from .client import iter_parallel
+from .client import MAX_WORKERS
+from .client import TRANSLATION_TIMEOUT
+
+PENDING = "PENDING"
+UPLOADED = "UPLOADED"
+TRANSLATING = "TRANSLATING"
+TRANSLATED = "TRANSLATED"
+DOWNLOADED = "DOWNLOADED"
+DONE = "DONE"
+STATES = (PENDING, UPLOADED, TRANSLATING, TRANSLATED, DOWNLOADED, DONE)
+
+
+class Journal(object):
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=FULL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS documents "
+            "(path TEXT PRIMARY KEY, destination TEXT, model_id TEXT, "
+            "tr_mode TEXT, state TEXT, document_id TEXT, error TEXT, "
+            "updated REAL, endpoint TEXT)"
+        )
+        self._connection.commit()
+
+    def _execute(self, sql, parameters=()):
+        with self._lock:
+            self._connection.execute(sql, parameters)
+            self._connection.commit()
+
+    def add(self, path, destination, model_id, tr_mode):
+        """add a document to translate. Documents already in the journal are
+        left as they are
+        """
+        self._execute(
+            "INSERT OR IGNORE INTO documents "
+            "VALUES (?, ?, ?, ?, ?, NULL, NULL, ?, NULL)",
+            (path, destination, model_id, tr_mode, PENDING, time.time()),
+        )
+
+    def entries(self, states=STATES):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT path, destination, model_id, tr_mode, state, document_id, "
+                "error, endpoint FROM documents WHERE state IN ({}) "
+                "ORDER BY path".format(
+                    ", ".join("?" * len(states))
+                ),
+                tuple(states),
+            ).fetchall()
+        keys = (
+            "path",
+            "destination",
+            "model_id",
+            "tr_mode",
+            "state",
+            "document_id",
+            "error",
+            "endpoint",
+        )
+        return [dict(zip(keys, row)) for row in rows]
+
+    def _set_state(self, path, state, document_id=None, endpoint=None):
+        if document_id is None:
+            self._execute(
+                "UPDATE documents SET state = ?, error = NULL, updated = ? "
+                "WHERE path = ?",
+                (state, time.time(), path),
+            )
+        else:
+            self._execute(
+                "UPDATE documents SET state = ?, document_id = ?, endpoint = ?, "
+                "error = NULL, updated = ? WHERE path = ?",
+                (state, document_id, endpoint, time.time(), path),
+            )
+
+    def _set_error(self, path, error):
+        self._execute(
+            "UPDATE documents SET error = ?, updated = ? WHERE path = ?",
+            (error, time.time(), path),
+        )
+
+    def resume(
+        self,
+        client,
+        concurrency=MAX_WORKERS,
+        retry_failed=True,
+        timeout=TRANSLATION_TIMEOUT,
+    ):
+        """continue every unfinished document from its last finished step,
+        yielding their entries as they finish. Documents that failed before
+        are retried from where they failed unless retry_failed is False
+        """
+        entries = [
+            entry
+            for entry in self.entries(STATES[:-1])
+            if retry_failed or entry["error"] is None
+        ]
+        arguments = ((client, entry, timeout) for entry in entries)
+        for _, entry in iter_parallel(self._process, arguments, concurrency):
+            yield entry
+
+    def _process(self, client, entry, timeout):
+        try:
+            self._run_steps(client, entry, timeout)
+        except Exception as e:
+            entry["error"] = str(e) or e.__class__.__name__
+            self._set_error(entry["path"], entry["error"])
+        return entry
+
+    def _run_steps(self, client, entry, timeout):
+        path = entry["path"]
+        if entry["state"] == PENDING:
+            response = client.upload(path)
+            _check(response, "upload")
+            entry["document_id"] = response["data"]["id"]
+            entry["endpoint"] = _endpoint_url(client, entry["document_id"])
+            self._advance(entry, UPLOADED, entry["document_id"], entry["endpoint"])
+        else:
+            _pin(client, entry)
+
+        document_id = entry["document_id"]
+        if entry["state"] == UPLOADED:
+            response = client.translate_document(
+                document_id, entry["model_id"], entry["tr_mode"]
+            )
+            _check(response, "translate_document")
+            self._advance(entry, TRANSLATING)
+
+        if entry["state"] == TRANSLATING:
+            try:
+                response = client.watcher.watch(document_id).result(timeout)
+            finally:
+                client.watcher.unwatch(document_id)
+            _check(response, "get_document_status")
+            self._advance(entry, TRANSLATED)
+
+        if entry["state"] == TRANSLATED:
+            response = client.download_document_to(document_id, entry["destination"])
+            _check(response, "download_document")
+            self._advance(entry, DOWNLOADED)
+
+        if entry["state"] == DOWNLOADED:
+            # an error answer means the document was already removed
+            if not client.remove(document_id):
+                raise RuntimeError("remove failed")
+            self._advance(entry, DONE)
+
+    def _advance(self, entry, state, document_id=None, endpoint=None):
+        self._set_state(entry["path"], state, document_id, endpoint)
+        entry["state"] = state
+        entry["error"] = None
+
+    def sweep(self, client, failed_only=True):
+        """remove from the server the documents of unfinished entries, by
+        default only the failed ones, and start those entries again from the
+        upload. Returns the removed document ids
+        """
+        removed = []
+        for entry in self.entries(STATES[1:-1]):
+            if failed_only and entry["error"] is None:
+                continue
+            _pin(client, entry)
+            client.remove(entry["document_id"])
+            self._execute(
+                "UPDATE documents SET state = ?, document_id = NULL, "
+                "endpoint = NULL, error = NULL, updated = ? WHERE path = ?",
+                (PENDING, time.time(), entry["path"]),
+            )
+            removed.append(entry["document_id"])
+        return removed
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def _endpoint_url(client, document_id):
+    router = getattr(client, "router", None)
+    endpoint = router.endpoint_for(document_id) if router is not None else None
+    return endpoint.url if endpoint is not None else None
+
+
+def _pin(client, entry):
+    """send the requests about the document of entry, uploaded by an earlier
+    process, to the server holding it
+    """
+    router = getattr(client, "router", None)
+    if router is not None and entry["endpoint"]:
+        if router.endpoint_for(entry["document_id"]) is None:
+            router.pin_url(entry["document_id"], entry["endpoint"])
+
+
+def _check(response, operation):
+    if (response or {}).get("status") != "success":
+        message = (response or {}).get("data", {}).get("message", "")
+        raise RuntimeError("{} failed {}".format(operation, message).strip())
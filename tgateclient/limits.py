@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Adaptive limits of the number of requests in flight to the server"""
+import threading
+import time
+
+from .client import DOCUMENT_OPERATION
+
+# operations that move documents or make the server translate them
+HEAVY_OPERATIONS = (
+    "translate/upload",
+    "translate/translate_document",
+    DOCUMENT_OPERATION,
+)
+
+
+class AIMDLimiter(object):
+    """additive increase, multiplicative decrease concurrency limit.
+
+    Every successful request raises the limit by 1/limit, so it grows by one
+    each time a full window of requests succeeds. Errors, timeouts, HTTP 429
+    and 5xx answers, and latencies over tolerance times the best recent
+    latency of the same operation multiply it by backoff, at most once per
+    latency period. Latencies are compared by operation as a limiter serves
+    operations as fast as get_document_status and as slow as
+    translate_string.
+    """
+
+    def __init__(
+        self, initial=4, min_limit=1, max_limit=64, backoff=0.5, tolerance=2.0
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self.baselines = {}
+        self._last_decrease = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency, status_code, operation=None):
+        """status_code is None when the request raised an exception"""
+        with self._condition:
+            self.in_flight -= 1
+            overloaded = status_code is None or status_code == 429 or status_code >= 500
+            if not overloaded:
+                baseline = self.baselines.get(operation)
+                if baseline is None or latency < baseline:
+                    baseline = latency
+                else:
+                    # drift slowly so the baseline follows lasting changes
+                    baseline += 0.01 * (latency - baseline)
+                self.baselines[operation] = baseline
+                overloaded = latency > baseline * self.tolerance
+
+            now = time.time()
+            if overloaded:
+                if now - self._last_decrease > latency:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+
+class ConcurrencyLimits(object):
+    """separate AIMDLimiter for heavy operations, uploads, document
+    translations and downloads, and light ones like get_document_status or
+    translate_string
+    """
+
+    def __init__(self, heavy=None, light=None):
+        self.heavy = heavy or AIMDLimiter(initial=2, max_limit=16)
+        self.light = light or AIMDLimiter(initial=4, max_limit=64)
+
+    def limiter_for(self, operation):
+        if operation in HEAVY_OPERATIONS:
+            return self.heavy
+        return self.light
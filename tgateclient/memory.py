@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""Fuzzy translation memory used by TGateClient.translate_string.
+
+Numbers and markup tags of the source texts are replaced by placeholders and
+whitespace is collapsed, so texts that only differ in those are the same
+entry, and the numbers and tags of the new text are put in the stored
+translation. Translations that do not copy every number and tag of their
+source, e.g. "1,000" translated as "1.000", are only used for the very same
+text. Similar texts are found with a MinHash index of their character
+n-grams, and scored with difflib.
+"""
+import difflib
+import hashlib
+import random
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+from .client import safe_encode
+
+THRESHOLD = 0.9
+NGRAM = 3
+NUM_PERM = 64
+BANDS = 16
+MAX_CANDIDATES = 20
+MAX_ENTRIES = 100000
+_PRIME = (1 << 61) - 1
+TOKEN_RE = re.compile(r"<[^<>]+>|\d+(?:[.,:]\d+)*")
+PLACEHOLDER_RE = re.compile(u"\ue000(\\d+)\ue001")
+SPACE_RE = re.compile(r"\s+", re.UNICODE)
+
+
+def _placeholder(index):
+    # private use characters, that do not appear in real texts
+    return u"\ue000{}\ue001".format(index)
+
+
+def normalize(text):
+    """returns text with its numbers and tags replaced by placeholders and
+    its whitespace collapsed, and the list of the replaced values
+    """
+    values = []
+
+    def replace(match):
+        values.append(match.group(0))
+        return _placeholder(len(values) - 1)
+
+    return SPACE_RE.sub(u" ", TOKEN_RE.sub(replace, text)).strip(), values
+
+
+def make_template(translation, values):
+    """replace in translation the numbers and tags copied from the source,
+    None if some of them are not copied as they are
+    """
+    unused = dict((index, value) for index, value in enumerate(values))
+
+    def replace(match):
+        for index, value in sorted(unused.items()):
+            if value == match.group(0):
+                del unused[index]
+                return _placeholder(index)
+        return match.group(0)
+
+    template = TOKEN_RE.sub(replace, translation)
+    return None if unused else template
+
+
+def fill_template(template, values):
+    """put values in the placeholders of template, None if there are not
+    enough values
+    """
+    try:
+        return PLACEHOLDER_RE.sub(lambda match: values[int(match.group(1))], template)
+    except IndexError:
+        return None
+
+
+class MinHasher(object):
+    def __init__(self, num_perm=NUM_PERM, ngram=NGRAM, seed=1):
+        self.ngram = ngram
+        generator = random.Random(seed)
+        self._permutations = [
+            (generator.randint(1, _PRIME - 1), generator.randint(0, _PRIME - 1))
+            for _ in range(num_perm)
+        ]
+
+    def shingles(self, text):
+        size = self.ngram
+        if len(text) <= size:
+            return set([text])
+        return set(text[i:i + size] for i in range(len(text) - size + 1))
+
+    def signature(self, text):
+        hashes = [zlib.crc32(safe_encode(shingle)) for shingle in self.shingles(text)]
+        return [
+            min((a * value + b) % _PRIME for value in hashes)
+            for a, b in self._permutations
+        ]
+
+
+class TranslationMemory(object):
+    """source and target pairs of earlier translations stored in a SQLite
+    database, looked up by similarity to the normalized source text.
+
+    lookup returns the stored translations whose source scores at least
+    threshold, from 0 to 1, with the numbers and tags of the new text.
+    Entries are kept apart by model_id, tr_mode and mime_type, and the
+    oldest ones are removed once there are more than max_entries.
+    """
+
+    def __init__(
+        self,
+        path,
+        threshold=THRESHOLD,
+        num_perm=NUM_PERM,
+        bands=BANDS,
+        ngram=NGRAM,
+        max_entries=MAX_ENTRIES,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.path = path
+        self.threshold = threshold
+        self.bands = bands
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._hasher = MinHasher(num_perm, ngram)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries "
+            "(id INTEGER PRIMARY KEY, scope TEXT, source TEXT, text TEXT, "
+            "target TEXT, exact INTEGER, created REAL, UNIQUE (scope, source))"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS bands (hash TEXT, entry INTEGER)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS bands_hash ON bands (hash)"
+        )
+        self._connection.commit()
+        self._size = self._connection.execute(
+            "SELECT COUNT(*) FROM entries"
+        ).fetchone()[0]
+
+    def _scope(self, model_id, tr_mode, mime_type):
+        return u"\0".join([model_id, tr_mode, mime_type])
+
+    def _band_hashes(self, scope, source):
+        signature = self._hasher.signature(source)
+        rows = len(signature) // self.bands
+        return [
+            hashlib.sha1(
+                safe_encode(
+                    u"{}\0{}\0{}".format(
+                        scope, band, signature[band * rows:(band + 1) * rows]
+                    )
+                )
+            ).hexdigest()
+            for band in range(self.bands)
+        ]
+
+    def add(self, text, translation, model_id, tr_mode, mime_type):
+        source, values = normalize(text)
+        target = make_template(translation, values)
+        # entries without a template are only found by exact lookups
+        exact = target is None
+        if exact:
+            target = translation
+        scope = self._scope(model_id, tr_mode, mime_type)
+        hashes = [] if exact else self._band_hashes(scope, source)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT id FROM entries WHERE scope = ? AND source = ?",
+                (scope, source),
+            ).fetchone()
+            if row is not None:
+                entry = row[0]
+                self._connection.execute(
+                    "UPDATE entries SET text = ?, target = ?, exact = ?, "
+                    "created = ? WHERE id = ?",
+                    (text, target, exact, time.time(), entry),
+                )
+                self._connection.execute("DELETE FROM bands WHERE entry = ?", (entry,))
+            else:
+                entry = self._connection.execute(
+                    "INSERT INTO entries (scope, source, text, target, exact, created) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (scope, source, text, target, exact, time.time()),
+                ).lastrowid
+                self._size += 1
+            self._connection.executemany(
+                "INSERT INTO bands VALUES (?, ?)",
+                [(band_hash, entry) for band_hash in hashes],
+            )
+            if row is None:
+                self._evict()
+            self._connection.commit()
+
+    def _evict(self):
+        if self._size <= self.max_entries:
+            return
+        # remove some extra entries so we do not evict on every insert
+        extra = self._size - self.max_entries + self.max_entries // 10
+        self._connection.execute(
+            "DELETE FROM entries WHERE id IN "
+            "(SELECT id FROM entries ORDER BY created LIMIT ?)",
+            (extra,),
+        )
+        self._connection.execute(
+            "DELETE FROM bands WHERE entry NOT IN (SELECT id FROM entries)"
+        )
+        self._size = max(self._size - extra, 0)
+
+    def lookup(self, text, model_id, tr_mode, mime_type, threshold=None):
+        """returns (score, translation, source text) of the best match
+        scoring at least threshold, self.threshold by default, or None
+        """
+        threshold = self.threshold if threshold is None else threshold
+        source, values = normalize(text)
+        scope = self._scope(model_id, tr_mode, mime_type)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT source, text, target, exact FROM entries "
+                "WHERE scope = ? AND source = ?",
+                (scope, source),
+            ).fetchone()
+            if row is not None and row[3] and row[1] != text:
+                # only the very same text can use its translation
+                row = None
+            candidates = [row] if row is not None else []
+            if not candidates and threshold < 1:
+                hashes = self._band_hashes(scope, source)
+                candidates = self._connection.execute(
+                    "SELECT source, text, target, exact FROM entries WHERE id IN "
+                    "(SELECT entry FROM bands WHERE hash IN ({}) GROUP BY entry "
+                    "ORDER BY COUNT(*) DESC LIMIT ?)".format(
+                        ", ".join("?" * len(hashes))
+                    ),
+                    tuple(hashes) + (MAX_CANDIDATES,),
+                ).fetchall()
+
+        best = None
+        for candidate_source, candidate_text, target, exact in candidates:
+            if exact:
+                best = (1.0, target, candidate_text)
+                continue
+            if candidate_source == source:
+                score = 1.0
+            else:
+                score = difflib.SequenceMatcher(
+                    None, source, candidate_source, autojunk=False
+                ).ratio()
+            if score < threshold or (best is not None and score <= best[0]):
+                continue
+            translation = fill_template(target, values)
+            if translation is not None:
+                best = (score, translation, candidate_text)
+
+        with self._lock:
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return best
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM entries")
+            self._connection.execute("DELETE FROM bands")
+            self._connection.commit()
+            self._size = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": self._size}
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
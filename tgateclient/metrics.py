@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""Per-operation metrics of TGateClient requests:
+
+    metrics = MetricsCollector()
+    client = TGateClient(url, username, password, metrics=metrics)
+    ...
+    print(metrics.to_prometheus())
+
+Any object with the record method of MetricsCollector can be used instead,
+to send the measures somewhere else.
+"""
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3 import connection
+from urllib3 import connectionpool
+
+# latency buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# request phases: sign is building the headers, connect opening a new
+# connection, wait sending the request until the response headers arrive and
+# transfer reading the response body
+PHASES = ("sign", "connect", "wait", "transfer", "total")
+
+_local = threading.local()
+
+
+def reset_connect_time():
+    _local.connect = 0
+
+
+def pop_connect_time():
+    elapsed = getattr(_local, "connect", 0)
+    _local.connect = 0
+    return elapsed
+
+
+class _TimedConnectMixin(object):
+    def connect(self):
+        start = time.time()
+        try:
+            super(_TimedConnectMixin, self).connect()
+        finally:
+            _local.connect = getattr(_local, "connect", 0) + time.time() - start
+
+
+class _TimedHTTPConnection(_TimedConnectMixin, connection.HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectMixin, connection.HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(connectionpool.HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(connectionpool.HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that measures how long it takes to open connections"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(TimedHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+
+class Histogram(object):
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[index] += 1
+                break
+
+    def snapshot(self):
+        cumulative = 0
+        buckets = []
+        for bucket, count in zip(self.buckets, self.counts):
+            cumulative += count
+            buckets.append((bucket, cumulative))
+        return {"count": self.count, "sum": self.sum, "buckets": buckets}
+
+
+class _OperationMetrics(object):
+    def __init__(self, buckets):
+        self.requests = 0
+        self.failures = 0
+        self.errors = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.status_codes = {}
+        self.latency = dict((phase, Histogram(buckets)) for phase in PHASES)
+
+
+class MetricsCollector(object):
+    """keeps latency histograms per operation and phase, byte counts, status
+    codes and the number of failures, which are the requests answered with
+    anything other than a HTTP 200 that the client turns into {}.
+    Requests that raise an exception are counted as errors.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._operations = {}
+        self._lock = threading.Lock()
+
+    def record(self, operation, phases, request_bytes, response_bytes, status_code):
+        """phases maps phase names to seconds. status_code is None when the
+        request raised an exception
+        """
+        with self._lock:
+            metrics = self._operations.get(operation)
+            if metrics is None:
+                metrics = self._operations[operation] = _OperationMetrics(
+                    self.buckets
+                )
+            metrics.requests += 1
+            if status_code is None:
+                metrics.errors += 1
+            elif status_code != 200:
+                metrics.failures += 1
+            metrics.status_codes[status_code] = (
+                metrics.status_codes.get(status_code, 0) + 1
+            )
+            metrics.request_bytes += request_bytes
+            metrics.response_bytes += response_bytes
+            for phase, elapsed in phases.items():
+                metrics.latency[phase].observe(elapsed)
+
+    def reset(self):
+        with self._lock:
+            self._operations = {}
+
+    def snapshot(self):
+        with self._lock:
+            return dict(
+                (
+                    operation,
+                    {
+                        "requests": metrics.requests,
+                        "failures": metrics.failures,
+                        "errors": metrics.errors,
+                        "request_bytes": metrics.request_bytes,
+                        "response_bytes": metrics.response_bytes,
+                        "status_codes": dict(metrics.status_codes),
+                        "latency": dict(
+                            (phase, histogram.snapshot())
+                            for phase, histogram in metrics.latency.items()
+                        ),
+                    },
+                )
+                for operation, metrics in self._operations.items()
+            )
+
+    def to_prometheus(self, prefix="tgateclient"):
+        """the metrics in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+
+        def counter(name, help, key):
+            lines.append("# HELP {}_{} {}".format(prefix, name, help))
+            lines.append("# TYPE {}_{} counter".format(prefix, name))
+            for operation, metrics in sorted(snapshot.items()):
+                lines.append(
+                    '{}_{}{{operation="{}"}} {}'.format(
+                        prefix, name, operation, metrics[key]
+                    )
+                )
+
+        counter("requests_total", "Requests sent.", "requests")
+        counter("failures_total", "Requests not answered with HTTP 200.", "failures")
+        counter("errors_total", "Requests that raised an exception.", "errors")
+        counter("request_bytes_total", "Request body bytes sent.", "request_bytes")
+        counter(
+            "response_bytes_total", "Response body bytes received.", "response_bytes"
+        )
+
+        name = "{}_responses_total".format(prefix)
+        lines.append("# HELP {} Responses by HTTP status code.".format(name))
+        lines.append("# TYPE {} counter".format(name))
+        for operation, metrics in sorted(snapshot.items()):
+            for status_code, count in sorted(
+                metrics["status_codes"].items(), key=lambda item: str(item[0])
+            ):
+                lines.append(
+                    '{}{{operation="{}",code="{}"}} {}'.format(
+                        name, operation, status_code or "error", count
+                    )
+                )
+
+        name = "{}_latency_seconds".format(prefix)
+        lines.append("# HELP {} Request latency by phase.".format(name))
+        lines.append("# TYPE {} histogram".format(name))
+        for operation, metrics in sorted(snapshot.items()):
+            for phase in PHASES:
+                histogram = metrics["latency"][phase]
+                labels = 'operation="{}",phase="{}"'.format(operation, phase)
+                for bucket, count in histogram["buckets"]:
+                    lines.append(
+                        '{}_bucket{{{},le="{}"}} {}'.format(name, labels, bucket, count)
+                    )
+                lines.append(
+                    '{}_bucket{{{},le="+Inf"}} {}'.format(
+                        name, labels, histogram["count"]
+                    )
+                )
+                lines.append("{}_sum{{{}}} {}".format(name, labels, histogram["sum"]))
+                lines.append(
+                    "{}_count{{{}}} {}".format(name, labels, histogram["count"])
+                )
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Typed results of the client operations.
+
+The body of a response is only decoded, with orjson or ujson when one of
+them is installed, the first time one of its fields is read. Results also
+behave as the read-only dicts returned by earlier versions, and to_dict
+returns that dict.
+"""
+import json
+
+from six.moves.collections_abc import Mapping
+
+try:
+    import orjson as _backend
+except ImportError:
+    try:
+        import ujson as _backend
+    except ImportError:
+        _backend = json
+
+JSON_BACKEND = _backend.__name__
+loads = _backend.loads
+
+
+def translation_from_message(text):
+    """translated text is inside the variable text, after the words 'target text:'
+    """
+    _, translation = text.split("target text:")
+    return translation
+
+
+class Result(Mapping):
+    """content is the raw JSON body of the response, and data the already
+    decoded one. A result without either, like the ones of failed requests,
+    is empty and false
+    """
+
+    __slots__ = ("_content", "_data")
+
+    def __init__(self, content=None, data=None):
+        self._content = content
+        self._data = data
+
+    @classmethod
+    def from_response(cls, response):
+        if response.status_code == 200:
+            return cls(response.content)
+        return cls(data={})
+
+    def _decode(self, content):
+        return loads(content)
+
+    def to_dict(self):
+        if self._data is None:
+            self._data = self._decode(self._content) if self._content else {}
+            self._content = None
+        return self._data
+
+    @property
+    def status(self):
+        return self.to_dict().get("status")
+
+    @property
+    def ok(self):
+        return self.status == "success"
+
+    @property
+    def id(self):
+        return self.to_dict().get("data", {}).get("id")
+
+    @property
+    def message(self):
+        return self.to_dict().get("data", {}).get("message")
+
+    def __getitem__(self, key):
+        return self.to_dict()[key]
+
+    def __iter__(self):
+        return iter(self.to_dict())
+
+    def __len__(self):
+        return len(self.to_dict())
+
+    def __bool__(self):
+        return bool(self._content) or bool(self.to_dict())
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, self.to_dict())
+
+
+class TranslationResult(Result):
+    __slots__ = ()
+
+    def _decode(self, content):
+        result = loads(content)
+        data = result.get("data")
+        if result.get("status") == "success" and "translation" not in data:
+            data["translation"] = translation_from_message(data["message"])
+        return result
+
+    @property
+    def translation(self):
+        return self.to_dict().get("data", {}).get("translation")
+
+    @property
+    def match(self):
+        """score of the translation memory match, None for server results"""
+        return self.to_dict().get("data", {}).get("match")
+
+
+class DocumentStatus(Result):
+    __slots__ = ()
+
+    @property
+    def state(self):
+        """translation status of the document, e.g. TRANSLATING"""
+        return self.id
+
+
+class ModelList(Result):
+    __slots__ = ()
+
+    @property
+    def models(self):
+        return self.to_dict().get("models", [])
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Retries of failed requests of the operations that are safe to repeat"""
+from email.utils import mktime_tz
+from email.utils import parsedate_tz
+
+import random
+import requests
+import threading
+import time
+
+from .routing import CircuitOpenError
+
+# operations that can be sent again without changing anything on the server
+RETRYABLE_OPERATIONS = (
+    "translate/models",
+    "translate/status",
+    "translate/properties",
+    "translate/download",
+    "translate/translate_string",
+)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_EXCEPTIONS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+
+def parse_retry_after(value, now=None):
+    """seconds to wait from a Retry-After header, in seconds or as a date"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(mktime_tz(parsed) - (now or time.time()), 0)
+
+
+class RetryPolicy(object):
+    """retries the requests of operations that fail with one of statuses or
+    a connection error or timeout, up to max_attempts attempts in total.
+
+    Attempts wait a random time up to backoff * 2 ** retry seconds, at most
+    max_backoff, or the Retry-After time given by the server when it is not
+    longer than max_retry_after.
+
+    The retry budget stops retry storms when the server is down: every
+    request adds budget_ratio to it, up to budget, and every retry takes one
+    from it, so in the long run at most that fraction of the requests are
+    retried.
+    """
+
+    def __init__(
+        self,
+        max_attempts=3,
+        backoff=0.1,
+        max_backoff=10,
+        max_retry_after=60,
+        budget=10,
+        budget_ratio=0.1,
+        operations=RETRYABLE_OPERATIONS,
+        statuses=RETRY_STATUSES,
+    ):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.budget = budget
+        self.budget_ratio = budget_ratio
+        self.operations = frozenset(operations)
+        self.statuses = frozenset(statuses)
+        self.retries = 0
+        self.exhausted = 0
+        self._tokens = float(budget)
+        self._lock = threading.Lock()
+
+    def start_request(self):
+        with self._lock:
+            self._tokens = min(self.budget, self._tokens + self.budget_ratio)
+
+    def _withdraw(self):
+        with self._lock:
+            if self._tokens < 1:
+                self.exhausted += 1
+                return False
+            self._tokens -= 1
+            self.retries += 1
+            return True
+
+    def delay(self, attempt, retry_after=None):
+        """seconds to wait before retrying after attempt, counted from 0, or
+        None when the server asks to wait too long
+        """
+        seconds = parse_retry_after(retry_after)
+        if seconds is not None:
+            return seconds if seconds <= self.max_retry_after else None
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def retry_response(self, attempt, response):
+        """seconds to wait before retrying after response, None to give up"""
+        if attempt + 1 >= self.max_attempts:
+            return None
+        if response.status_code not in self.statuses:
+            return None
+        delay = self.delay(attempt, response.headers.get("Retry-After"))
+        if delay is None or not self._withdraw():
+            return None
+        return delay
+
+    def retry_exception(self, attempt, exception):
+        """seconds to wait before retrying after exception, None to give up"""
+        if attempt + 1 >= self.max_attempts:
+            return None
+        # the breaker of the endpoint will not close in the meantime
+        if isinstance(exception, CircuitOpenError):
+            return None
+        if not isinstance(exception, RETRY_EXCEPTIONS) or not self._withdraw():
+            return None
+        return self.delay(attempt)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""Routing of requests between several TGATE servers"""
+import logging
+import requests
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+EWMA = "ewma"
+LEAST_OUTSTANDING = "least_outstanding"
+STRATEGIES = (EWMA, LEAST_OUTSTANDING)
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30
+PROBE_INTERVAL = 10
+DECAY = 0.3
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """raised instead of sending a request to an endpoint known to be down"""
+
+
+class Endpoint(object):
+    __slots__ = (
+        "url",
+        "outstanding",
+        "latency",
+        "failures",
+        "state",
+        "opened_at",
+        "requests",
+    )
+
+    def __init__(self, url):
+        self.url = url if url.endswith("/") else url + "/"
+        self.outstanding = 0
+        self.latency = None
+        self.failures = 0
+        self.state = CLOSED
+        self.opened_at = 0
+        self.requests = 0
+
+    def __repr__(self):
+        return "Endpoint({!r})".format(self.url)
+
+
+class Router(object):
+    """chooses the endpoint of each request among urls, by the EWMA of their
+    latency weighted by the requests in flight, or by the number of requests
+    in flight alone with the least_outstanding strategy.
+
+    After failure_threshold consecutive failures, errors or HTTP 5xx, the
+    circuit breaker of an endpoint opens and it gets no requests for
+    reset_timeout seconds. Then it gets a single trial request, which closes
+    the breaker again if it succeeds. A background probe calls hello on every
+    endpoint each probe_interval seconds so down endpoints are found, and
+    recovered ones brought back, without failing real requests.
+
+    Documents stay on the server they were uploaded to, so requests about
+    a pinned document_id always go to its endpoint.
+    """
+
+    def __init__(
+        self,
+        urls,
+        strategy=EWMA,
+        failure_threshold=FAILURE_THRESHOLD,
+        reset_timeout=RESET_TIMEOUT,
+        probe_interval=PROBE_INTERVAL,
+        decay=DECAY,
+    ):
+        if not urls:
+            raise ValueError("At least one url is required")
+        if strategy not in STRATEGIES:
+            raise ValueError("Unknown strategy: {}".format(strategy))
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.strategy = strategy
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_interval = probe_interval
+        self.decay = decay
+        self._pins = {}
+        self._lock = threading.Lock()
+        self._probe_thread = None
+        self._stopped = threading.Event()
+
+    def _available(self, endpoint, now):
+        if endpoint.state == CLOSED:
+            return True
+        return endpoint.state == OPEN and now - endpoint.opened_at >= self.reset_timeout
+
+    def _score(self, endpoint):
+        latency = endpoint.latency or 0
+        if self.strategy == LEAST_OUTSTANDING:
+            return (endpoint.outstanding, latency)
+        return (latency * (endpoint.outstanding + 1), endpoint.outstanding)
+
+    def acquire(self, document_id=None):
+        """endpoint for the next request, counted as outstanding until
+        release is called
+        """
+        now = time.time()
+        with self._lock:
+            endpoint = self._pins.get(document_id) if document_id else None
+            if endpoint is not None:
+                if not self._available(endpoint, now):
+                    raise CircuitOpenError(
+                        "{} holding document {} is down".format(
+                            endpoint.url, document_id
+                        )
+                    )
+            else:
+                available = [e for e in self.endpoints if self._available(e, now)]
+                if not available:
+                    raise CircuitOpenError("All the endpoints are down")
+                endpoint = min(available, key=self._score)
+            if endpoint.state == OPEN:
+                # let a single trial request through
+                endpoint.state = HALF_OPEN
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint, latency, ok):
+        with self._lock:
+            endpoint.outstanding -= 1
+            self._record(endpoint, latency, ok)
+
+    def _record(self, endpoint, latency, ok):
+        if ok:
+            if endpoint.latency is None:
+                endpoint.latency = latency
+            else:
+                endpoint.latency += self.decay * (latency - endpoint.latency)
+            endpoint.failures = 0
+            endpoint.state = CLOSED
+            return
+        endpoint.failures += 1
+        if (
+            endpoint.state == HALF_OPEN
+            or endpoint.failures >= self.failure_threshold
+        ):
+            if endpoint.state != OPEN:
+                logger.warning("Circuit breaker of %s open", endpoint.url)
+            endpoint.state = OPEN
+            endpoint.opened_at = time.time()
+
+    def pin(self, document_id, endpoint):
+        with self._lock:
+            self._pins[document_id] = endpoint
+
+    def pin_url(self, document_id, url):
+        """pin document_id to the endpoint with url, as given by
+        endpoint_for, returns False when there is no such endpoint
+        """
+        url = url if url.endswith("/") else url + "/"
+        for endpoint in self.endpoints:
+            if endpoint.url == url:
+                self.pin(document_id, endpoint)
+                return True
+        return False
+
+    def unpin(self, document_id):
+        with self._lock:
+            self._pins.pop(document_id, None)
+
+    def endpoint_for(self, document_id):
+        return self._pins.get(document_id)
+
+    def start_probing(self, probe):
+        """call probe(endpoint), which returns whether it is healthy, for
+        every endpoint each probe_interval seconds in a background thread
+        """
+        with self._lock:
+            if self._probe_thread is not None or not self.probe_interval:
+                return
+            self._stopped.clear()
+            self._probe_thread = threading.Thread(
+                target=self._probe_loop, args=(probe,), name="tgateclient-probe"
+            )
+            self._probe_thread.daemon = True
+            self._probe_thread.start()
+
+    def _probe_loop(self, probe):
+        while not self._stopped.wait(self.probe_interval):
+            for endpoint in self.endpoints:
+                start = time.time()
+                try:
+                    ok = probe(endpoint)
+                except Exception:
+                    ok = False
+                with self._lock:
+                    self._record(endpoint, time.time() - start, ok)
+
+    def stop_probing(self):
+        with self._lock:
+            thread, self._probe_thread = self._probe_thread, None
+            self._stopped.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def snapshot(self):
+        with self._lock:
+            return [
+                {
+                    "url": endpoint.url,
+                    "state": endpoint.state,
+                    "latency": endpoint.latency,
+                    "outstanding": endpoint.outstanding,
+                    "failures": endpoint.failures,
+                    "requests": endpoint.requests,
+                }
+                for endpoint in self.endpoints
+            ]
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""Splitting of long texts in segments that can be translated separately"""
+import re
+
+# strength of the boundary after a piece of text, higher is a better place
+# to split it
+INSIDE = -1
+WORD = 0
+SENTENCE = 1
+LINE = 2
+PARAGRAPH = 3
+
+BLOCK_TAGS = (
+    "address", "article", "aside", "blockquote", "br", "dd", "div", "dl", "dt",
+    "figure", "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header",
+    "hr", "li", "main", "nav", "ol", "p", "pre", "section", "table", "td",
+    "th", "tr", "ul",
+)
+
+_WHITESPACE = re.compile(r"\s+")
+_TAG = re.compile(r"<[^>]*>")
+_TAG_NAME = re.compile(r"</?\s*([a-zA-Z0-9]+)")
+_SENTENCE_END = u".!?;:…"
+
+
+def _text_pieces(text):
+    """split text in words followed by their whitespace"""
+    pieces = []
+    position = 0
+    for match in _WHITESPACE.finditer(text):
+        word = text[position:match.start()]
+        space = match.group()
+        if space.count("\n") > 1:
+            strength = PARAGRAPH
+        elif "\n" in space:
+            strength = LINE
+        elif word and word[-1] in _SENTENCE_END:
+            strength = SENTENCE
+        else:
+            strength = WORD
+        pieces.append((word + space, strength))
+        position = match.end()
+    if position < len(text):
+        pieces.append((text[position:], INSIDE))
+    return pieces
+
+
+def _html_pieces(text):
+    pieces = []
+    position = 0
+    for match in _TAG.finditer(text):
+        pieces.extend(_text_pieces(text[position:match.start()]))
+        tag = match.group()
+        name = _TAG_NAME.match(tag)
+        is_block = name is not None and name.group(1).lower() in BLOCK_TAGS
+        if is_block and (tag.startswith("</") or tag.endswith("/>")):
+            strength = PARAGRAPH
+        elif is_block and name.group(1).lower() in ("br", "hr"):
+            strength = PARAGRAPH
+        else:
+            strength = INSIDE
+        pieces.append((tag, strength))
+        position = match.end()
+    pieces.extend(_text_pieces(text[position:]))
+    return pieces
+
+
+def split_text(text, mime_type, max_size):
+    """split text in segments of up to max_size characters, cutting at
+    paragraph, line, sentence or word boundaries, in that order of
+    preference. HTML tags are never cut.
+
+    Returns a list of (prefix, segment, suffix) tuples, where prefix and
+    suffix are the whitespace around the segment, so joining them all gives
+    back the original text.
+    """
+    if mime_type and "html" in mime_type:
+        pieces = _html_pieces(text)
+    else:
+        pieces = _text_pieces(text)
+
+    segments = []
+    current = []
+    size = 0
+    for piece, strength in pieces:
+        while current and size + len(piece) > max_size:
+            # cut at the best boundary of the second half of the segment
+            start = len(current) // 2
+            cut = max(
+                range(start, len(current)), key=lambda i: (current[i][1], i)
+            ) + 1
+            segments.append(u"".join(item for item, _ in current[:cut]))
+            current = current[cut:]
+            size = sum(len(item) for item, _ in current)
+        current.append((piece, strength))
+        size += len(piece)
+    if current:
+        segments.append(u"".join(item for item, _ in current))
+
+    result = []
+    for segment in segments:
+        stripped = segment.strip()
+        if not stripped:
+            result.append((segment, u"", u""))
+            continue
+        start = len(segment) - len(segment.lstrip())
+        end = start + len(stripped)
+        result.append((segment[:start], stripped, segment[end:]))
+    return result
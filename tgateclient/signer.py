@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""HMAC signing of the requests sent to the TGATE server"""
+import calendar
+import email.utils
+import hashlib
+import hmac
+import six
+import threading
+import time
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+# Date headers have a resolution of one second, smaller differences with
+# the server clock are ignored
+MIN_SKEW = 2
+
+
+def safe_encode(value):
+    if isinstance(value, six.text_type):
+        return value.encode("utf-8")
+    else:
+        return value
+
+
+class RequestSigner(object):
+    """builds the client, timestamp and data headers of each request.
+
+    The keyed HMAC state is computed once and copied for every request, the
+    formatted timestamp is reused during the same second, and the offset of
+    the server clock is learnt from the Date header of its responses.
+    """
+
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+        self._hmac = None
+        self.offset = 0
+        self._last_date = None
+        self._timestamp = (None, None)
+        self._lock = threading.Lock()
+
+    def timestamp(self):
+        now = int(time.time() + self.offset)
+        second, timestamp = self._timestamp
+        if second != now:
+            timestamp = time.strftime(TIMESTAMP_FORMAT, time.gmtime(now))
+            self._timestamp = (now, timestamp)
+        return timestamp
+
+    def _headers(self, timestamp, operation, args):
+        if self._hmac is None:
+            self._hmac = hmac.new(safe_encode(self.password), digestmod=hashlib.sha512)
+        mac = self._hmac.copy()
+        mac.update(six.b("{}{}{}".format(timestamp, "".join(args), operation)))
+        return {"client": self.username, "timestamp": timestamp, "data": mac.hexdigest()}
+
+    def sign(self, operation, *args):
+        return self._headers(self.timestamp(), operation, args)
+
+    def update_clock(self, date):
+        """learn the clock offset from the Date header of a server response"""
+        if not date or date == self._last_date:
+            return
+        parsed = email.utils.parsedate(date)
+        if parsed is None:
+            return
+        skew = calendar.timegm(parsed) - time.time()
+        with self._lock:
+            self._last_date = date
+            if abs(skew) >= MIN_SKEW:
+                self.offset = int(round(skew))
+            elif abs(self.offset) >= MIN_SKEW:
+                self.offset = 0
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Coalescing of identical concurrent calls"""
+import copy
+import functools
+import six
+import sys
+import threading
+
+
+class _Call(object):
+    __slots__ = ("event", "result", "error", "waiters")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """runs a function once for all the callers that ask for the same key
+    at the same time. The caller that made the call gets its result and the
+    rest get copies of it, or the same exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, function, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                six.reraise(*call.error)
+            return copy.deepcopy(call.result)
+
+        result = None
+        try:
+            result = function(*args, **kwargs)
+        except Exception:
+            call.error = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                waiters = call.waiters
+            if call.error is None and waiters:
+                # the result is a mutable dict the caller may change
+                call.result = copy.deepcopy(result)
+            call.event.set()
+        return result
+
+
+def coalesced(method):
+    """decorator for TGateClient methods, so identical concurrent calls share
+    one request when the method name is in self.coalesce
+    """
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if name not in self.coalesce:
+            return method(self, *args, **kwargs)
+        key = (name, args, tuple(sorted(kwargs.items())))
+        return self._singleflight.do(key, method, self, *args, **kwargs)
+
+    return wrapper
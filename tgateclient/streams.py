@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Streaming request bodies, so big documents are never held in memory"""
+import hashlib
+import io
+import mmap
+import os
+import six
+import uuid
+
+CHUNK_SIZE = 64 * 1024
+
+
+class DocumentSource(object):
+    """wraps a path, an open binary file or a bytes/memoryview object and
+    reads it in chunks.
+
+    Only what is opened here is closed by close().
+    """
+
+    def __init__(self, document, filename=None, use_mmap=False):
+        self._to_close = []
+        # strings are paths, also in python 2 where str is bytes
+        if isinstance(document, six.string_types):
+            fp = open(document, "rb")
+            self._to_close.append(fp)
+            self._init_file(fp, filename or document, use_mmap)
+        elif isinstance(document, (bytes, bytearray, memoryview)):
+            if filename is None:
+                raise ValueError("filename is required when uploading bytes")
+            self.filename = os.path.basename(filename)
+            self._view = memoryview(document)
+            self.length = self._view.nbytes
+            self._position = 0
+            self._start = 0
+            self._fp = None
+        else:
+            filename = filename or getattr(document, "name", None)
+            if not isinstance(filename, six.string_types):
+                raise ValueError("filename is required when uploading this file")
+            self._init_file(document, filename, use_mmap)
+
+    def _init_file(self, fp, filename, use_mmap):
+        self._view = None
+        self.filename = os.path.basename(filename)
+        self.length = self._remaining_length(fp)
+        try:
+            self._start = fp.tell()
+        except (AttributeError, IOError, OSError):
+            self._start = None
+        if use_mmap and self.length and fp.tell() == 0:
+            mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            self._to_close.append(mapped)
+            fp = mapped
+        self._fp = fp
+
+    def _remaining_length(self, fp):
+        try:
+            position = fp.tell()
+            end = fp.seek(0, io.SEEK_END)
+            if end is None:  # python 2 files
+                end = fp.tell()
+            fp.seek(position)
+            return end - position
+        except (AttributeError, IOError, OSError):
+            return None
+
+    def digest(self, chunk_size=CHUNK_SIZE):
+        """sha256 hex digest of the contents, or None when the source can not
+        be read twice. The source is left at the same position
+        """
+        sha = hashlib.sha256()
+        if self._view is not None:
+            sha.update(self._view[self._position:])
+            return sha.hexdigest()
+        try:
+            position = self._fp.tell()
+        except (AttributeError, IOError, OSError):
+            return None
+        chunk = self._fp.read(chunk_size)
+        while chunk:
+            sha.update(chunk)
+            chunk = self._fp.read(chunk_size)
+        self._fp.seek(position)
+        return sha.hexdigest()
+
+    def restart(self):
+        """go back to where reading started, returns False if the source can
+        not be read twice
+        """
+        if self._view is not None:
+            self._position = self._start
+            return True
+        if self._start is None:
+            return False
+        try:
+            self._fp.seek(self._start)
+        except (AttributeError, IOError, OSError):
+            return False
+        return True
+
+    def read(self, size):
+        if self._view is not None:
+            chunk = self._view[self._position:self._position + size].tobytes()
+            self._position += len(chunk)
+            return chunk
+        return self._fp.read(size)
+
+    def close(self):
+        while self._to_close:
+            self._to_close.pop().close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MultipartStream(object):
+    """multipart/form-data body with a single file field.
+
+    requests sends it as it is read, chunk_size bytes at a time, with a
+    Content-Length header taken from self.len when the size of the source
+    is known, and chunked otherwise.
+    progress, if given, is called with (bytes_sent, total_bytes) after each
+    chunk; total_bytes is None for unsized sources.
+    """
+
+    def __init__(
+        self,
+        field,
+        source,
+        content_type="application/octet-stream",
+        chunk_size=CHUNK_SIZE,
+        progress=None,
+    ):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = "multipart/form-data; boundary={}".format(self.boundary)
+        self.source = source
+        self.chunk_size = chunk_size
+        self.progress = progress
+        filename = source.filename.replace('"', "%22")
+        self._head = (
+            '--{}\r\nContent-Disposition: form-data; name="{}"; filename="{}"\r\n'
+            "Content-Type: {}\r\n\r\n".format(
+                self.boundary, field, filename, content_type
+            )
+        ).encode("utf-8")
+        self._tail = "\r\n--{}--\r\n".format(self.boundary).encode("utf-8")
+        if source.length is None:
+            self.len = None
+        else:
+            self.len = len(self._head) + source.length + len(self._tail)
+        self._sent = 0
+        self._chunks = self._iter_chunks()
+
+    def _iter_chunks(self):
+        yield self._head
+        while True:
+            chunk = self.source.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        yield self._tail
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            self._sent += len(chunk)
+            if self.progress is not None:
+                self.progress(self._sent, self.len)
+            yield chunk
+
+    def read(self, size=-1):
+        # urllib3 reads file-like bodies, the size asked for is ignored as
+        # our own chunks are already bounded
+        return next(iter(self), b"")
@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+"""A local stand-in for the TGATE server, to test and benchmark the client
+without a real server:
+
+    with FakeTGateServer(username="test", password="test") as server:
+        client = TGateClient(server.url, "test", "test")
+        client.translate_string("Kaixo", "generic_eu2es", "MachineTranslation", "text/plain")
+
+It implements the operations used by TGateClient, checks the signature of
+every request and can add latency and errors to the responses. Translating
+returns the original text and documents are translated as they are.
+"""
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib.parse import urlparse
+
+import calendar
+import datetime
+import hashlib
+import hmac
+import json
+import random
+import re
+import six
+import threading
+import time
+import uuid
+
+from .client import safe_encode
+from .compression import compress
+from .compression import decompress
+from .compression import MIN_SIZE
+
+MAX_SKEW = 300
+MODELS = ["generic_en2es", "generic_es2en", "generic_eu2es", "generic_es2eu"]
+
+
+class _HTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # room for the connections opened at once by the benchmark, otherwise
+    # they are dropped and retried, and that time counted as latency
+    request_queue_size = 128
+
+
+class FakeTGateServer(object):
+    """latency is the number of seconds, or a function returning them, to
+    wait before answering; error_rate the fraction of requests answered with
+    a HTTP 500 error and translation_time how long documents stay in the
+    TRANSLATING status.
+
+    With compression the server accepts gzip and deflate request bodies,
+    announcing it in the Accept-Encoding header of its responses, and
+    compresses responses of at least MIN_SIZE bytes. Without it compressed
+    request bodies are rejected with HTTP 415.
+
+    With drop_after the connection is closed after sending that many bytes
+    of each downloaded document, to test resumed downloads.
+    """
+
+    def __init__(
+        self,
+        username="test",
+        password="test",
+        host="127.0.0.1",
+        port=0,
+        latency=0,
+        error_rate=0,
+        translation_time=0,
+        max_skew=MAX_SKEW,
+        models=MODELS,
+        compression=False,
+        drop_after=None,
+    ):
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.error_rate = error_rate
+        self.translation_time = translation_time
+        self.max_skew = max_skew
+        self.models = list(models)
+        self.compression = compression
+        self.drop_after = drop_after
+        self.documents = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+        self._httpd = _HTTPServer((host, port), _Handler)
+        self._httpd.tgate = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return "http://{}:{}/".format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def check_signature(self, headers, operation, *args):
+        timestamp = headers.get("timestamp", "")
+        try:
+            sent = datetime.datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ")
+        except ValueError:
+            return False
+        if abs(calendar.timegm(sent.timetuple()) - time.time()) > self.max_skew:
+            return False
+        datastring = "{}{}{}".format(timestamp, "".join(args), operation)
+        data = hmac.new(
+            safe_encode(self.password), six.b(datastring), hashlib.sha512
+        ).hexdigest()
+        return headers.get("client") == self.username and hmac.compare_digest(
+            safe_encode(headers.get("data", "")), safe_encode(data)
+        )
+
+    def document_status(self, document):
+        if document["translated"] is None:
+            return "READY"
+        if time.time() < document["translated"]:
+            return "TRANSLATING"
+        return "TRANSLATED"
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def tgate(self):
+        return self.server.tgate
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def _handle(self, method):
+        tgate = self.tgate
+        body = self._read_body()
+        with tgate.lock:
+            tgate.requests += 1
+        encoding = self.headers.get("Content-Encoding")
+        if encoding:
+            if not tgate.compression:
+                return self._send(415, b"Unsupported Media Type", "text/plain")
+            body = decompress(body, encoding)
+        latency = tgate.latency() if callable(tgate.latency) else tgate.latency
+        if latency:
+            time.sleep(latency)
+        if tgate.error_rate and random.random() < tgate.error_rate:
+            return self._send(500, b"Internal Server Error", "text/plain")
+
+        path = urlparse(self.path).path.lstrip("/")
+        if path.startswith("documents/") and method == "GET":
+            return self._send_document(path[len("documents/"):])
+        handler = self.operations.get(path)
+        if handler is None:
+            return self._send(404, b"Not Found", "text/plain")
+        status, result = handler(self, body)
+        if isinstance(result, bytes):
+            return self._send(status, result, "text/plain")
+        self._send(status, json.dumps(result).encode("utf-8"), "application/json")
+
+    def _read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip(), 16)
+                if not size:
+                    self.rfile.readline()
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b"".join(chunks)
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _send(self, status, body, content_type, headers=None, drop_after=None):
+        headers = dict(headers or {})
+        if self.headers.get("Connection", "").lower() == "close":
+            # otherwise the client may reuse the connection as it is closed
+            headers["Connection"] = "close"
+        if self.tgate.compression:
+            headers["Accept-Encoding"] = "gzip, deflate"
+            accepted = self.headers.get("Accept-Encoding", "")
+            if status == 200 and len(body) >= MIN_SIZE and "gzip" in accepted:
+                body = compress(body, "gzip")
+                headers["Content-Encoding"] = "gzip"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if drop_after is not None and drop_after < len(body):
+            self.wfile.write(body[:drop_after])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def _json(self, body):
+        try:
+            return json.loads(body.decode("utf-8"))
+        except ValueError:
+            return {}
+
+    def _denied(self):
+        return 401, {"status": "error", "data": {"message": "Invalid signature"}}
+
+    def _error(self, message):
+        return 200, {"status": "error", "data": {"message": message}}
+
+    def _document(self, operation, body):
+        """check the signature of the operations that receive a document id
+        and return the document, or an error response
+        """
+        document_id = self._json(body).get("id", "")
+        if not self.tgate.check_signature(self.headers, operation, document_id):
+            return None, self._denied()
+        document = self.tgate.documents.get(document_id)
+        if document is None:
+            return None, self._error("Unknown document")
+        return document, None
+
+    def hello(self, body):
+        return 200, b"Translation Service says: hello"
+
+    def upload(self, body):
+        boundary = self.headers.get("Content-Type", "").partition("boundary=")[2]
+        parts = body.split(b"--" + safe_encode(boundary))
+        if not boundary or len(parts) < 3:
+            return 400, {"status": "error", "data": {"message": "Invalid upload"}}
+        part_headers, _, contents = parts[1].partition(b"\r\n\r\n")
+        match = re.search(b'filename="([^"]*)"', part_headers)
+        filename = match.group(1).decode("utf-8") if match else ""
+        if not self.tgate.check_signature(self.headers, "translate/upload", filename):
+            return self._denied()
+        document_id = uuid.uuid4().hex
+        with self.tgate.lock:
+            self.tgate.documents[document_id] = {
+                "id": document_id,
+                "filename": filename,
+                "contents": contents[:-2],
+                "translated": None,
+            }
+        return 200, {"status": "success", "data": {"id": document_id}}
+
+    def download(self, body):
+        document, error = self._document("translate/download", body)
+        if error:
+            return error
+        url = "http://{}/documents/{}".format(self.headers.get("Host"), document["id"])
+        return 200, {"status": "success", "data": {"id": url}}
+
+    def _send_document(self, document_id):
+        document = self.tgate.documents.get(document_id)
+        if document is None:
+            return self._send(404, b"Not Found", "text/plain")
+        contents = document["contents"]
+        headers = {"Accept-Ranges": "bytes"}
+        match = re.match(r"bytes=(\d+)-$", self.headers.get("Range", ""))
+        if match and int(match.group(1)) < len(contents):
+            start = int(match.group(1))
+            headers["Content-Range"] = "bytes {}-{}/{}".format(
+                start, len(contents) - 1, len(contents)
+            )
+            return self._send(
+                206,
+                contents[start:],
+                "application/octet-stream",
+                headers,
+                self.tgate.drop_after,
+            )
+        self._send(
+            200, contents, "application/octet-stream", headers, self.tgate.drop_after
+        )
+
+    def remove(self, body):
+        document, error = self._document("translate/remove_document", body)
+        if error:
+            return error
+        with self.tgate.lock:
+            self.tgate.documents.pop(document["id"], None)
+        return 200, {"status": "success", "data": {"id": document["id"]}}
+
+    def properties(self, body):
+        document, error = self._document("translate/properties", body)
+        if error:
+            return error
+        return 200, {
+            "status": "success",
+            "data": {
+                "id": document["id"],
+                "filename": document["filename"],
+                "size": len(document["contents"]),
+                "status": self.tgate.document_status(document),
+            },
+        }
+
+    def status(self, body):
+        document, error = self._document("translate/status", body)
+        if error:
+            return error
+        return 200, {
+            "status": "success",
+            "data": {"id": self.tgate.document_status(document)},
+        }
+
+    def document_id(self, body):
+        filename = self._json(body).get("filename", "")
+        if not self.tgate.check_signature(
+            self.headers, "translate/document_id", filename
+        ):
+            return self._denied()
+        for document in list(self.tgate.documents.values()):
+            if document["filename"] == filename:
+                return 200, {"status": "success", "data": {"id": document["id"]}}
+        return self._error("Unknown document")
+
+    def models(self, body):
+        if not self.tgate.check_signature(self.headers, "translate/models"):
+            return self._denied()
+        return 200, {
+            "status": "success",
+            "data": {"id": len(self.tgate.models)},
+            "models": self.tgate.models,
+        }
+
+    def translate_document(self, body):
+        data = self._json(body)
+        document_id = data.get("document_id", "")
+        model_id = data.get("model_id", "")
+        if not self.tgate.check_signature(
+            self.headers, "translate/translate_document", document_id, model_id
+        ):
+            return self._denied()
+        document = self.tgate.documents.get(document_id)
+        if document is None:
+            return self._error("Unknown document")
+        if model_id not in self.tgate.models:
+            return self._error("Unknown model")
+        document["translated"] = time.time() + self.tgate.translation_time
+        return 200, {"status": "success", "data": {"id": document_id}}
+
+    def translate_string(self, body):
+        data = self._json(body)
+        text = data.get("text", "")
+        model_id = data.get("model_id", "")
+        if not self.tgate.check_signature(
+            self.headers,
+            "translate/translate_string",
+            text,
+            model_id,
+            data.get("mime", ""),
+        ):
+            return self._denied()
+        if model_id not in self.tgate.models:
+            return self._error("Unknown model")
+        return 200, {
+            "status": "success",
+            "data": {
+                "id": uuid.uuid4().hex,
+                "message": u"source text: {} characters target text:{}".format(
+                    len(text), text
+                ),
+            },
+        }
+
+    operations = {
+        "test/hello": hello,
+        "translate/upload": upload,
+        "translate/download": download,
+        "translate/remove_document": remove,
+        "translate/properties": properties,
+        "translate/status": status,
+        "translate/document_id": document_id,
+        "translate/models": models,
+        "translate/translate_document": translate_document,
+        "translate/translate_string": translate_string,
+    }
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""Tracks the translation status of many documents from a single thread"""
+from concurrent import futures
+
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# get_document_status values while a translation is running
+PENDING_STATUSES = ("TRANSLATING",)
+MIN_INTERVAL = 1
+MAX_INTERVAL = 30
+BACKOFF = 1.5
+JITTER = 0.2
+EXPECTED_DURATION = 2
+
+
+class _Watch(object):
+    def __init__(self, document_id):
+        self.document_id = document_id
+        self.started = time.time()
+        self.delay = 0
+        self.state = None
+        self.callbacks = []
+        self.future = futures.Future()
+
+
+class StatusWatcher(object):
+    """polls get_document_status for every watched document from one
+    scheduler thread.
+
+    The first poll of a document happens when translations usually finish,
+    learnt from the previous ones, and later polls back off exponentially
+    with some jitter up to max_interval seconds.
+    """
+
+    def __init__(
+        self,
+        client,
+        min_interval=MIN_INTERVAL,
+        max_interval=MAX_INTERVAL,
+        backoff=BACKOFF,
+        jitter=JITTER,
+        expected_duration=EXPECTED_DURATION,
+        pending_statuses=PENDING_STATUSES,
+    ):
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.expected_duration = expected_duration
+        self.pending_statuses = pending_statuses
+        self.requests = 0
+        self._watches = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def watch(self, document_id, callback=None):
+        """start watching document_id. Returns a future with the last
+        get_document_status response, once the document is no longer being
+        translated.
+
+        callback, if given, is called with (document_id, old_state,
+        new_state, response) on every status change.
+        """
+        with self._condition:
+            watch = self._watches.get(document_id)
+            if watch is None:
+                watch = _Watch(document_id)
+                self._watches[document_id] = watch
+                self._schedule(watch, self._next_delay(watch))
+                self._start()
+            if callback is not None:
+                watch.callbacks.append(callback)
+        return watch.future
+
+    def unwatch(self, document_id):
+        with self._condition:
+            watch = self._watches.pop(document_id, None)
+        if watch is not None:
+            watch.future.cancel()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+            watches, self._watches = self._watches, {}
+            self._heap = []
+        for watch in watches.values():
+            watch.future.cancel()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def _start(self):
+        self._stopped = False
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="tgate-watcher")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _schedule(self, watch, delay):
+        heapq.heappush(self._heap, (time.time() + delay, next(self._counter), watch))
+        self._condition.notify()
+
+    def _next_delay(self, watch):
+        elapsed = time.time() - watch.started
+        if elapsed < self.expected_duration:
+            delay = self.expected_duration - elapsed
+        elif watch.delay:
+            delay = watch.delay * self.backoff
+        else:
+            delay = self.min_interval
+        watch.delay = min(max(delay, self.min_interval), self.max_interval)
+        return watch.delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and (
+                    not self._heap or self._heap[0][0] > time.time()
+                ):
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+                _, _, watch = heapq.heappop(self._heap)
+                if self._watches.get(watch.document_id) is not watch:
+                    continue
+            self._poll(watch)
+
+    def _get_status(self, watch):
+        """status response of the document of watch, None if the request
+        failed and it has to be polled again
+        """
+        self.requests += 1
+        try:
+            response = self.client.get_document_status(watch.document_id)
+        except Exception:
+            logger.exception("Error polling the status of %s", watch.document_id)
+            return None
+        if not response.get("status"):
+            # the request failed, e.g. with HTTP 503, the server did not say
+            # the document has an error
+            logger.warning("Could not get the status of %s", watch.document_id)
+            return None
+        return response
+
+    def _poll(self, watch):
+        response = self._get_status(watch)
+        if response is not None:
+            if response.get("status") == "success":
+                state = response.get("data", {}).get("id")
+            else:
+                state = "ERROR"
+            first_poll = watch.state is None
+            if state != watch.state:
+                old_state, watch.state = watch.state, state
+                for callback in watch.callbacks:
+                    try:
+                        callback(watch.document_id, old_state, state, response)
+                    except Exception:
+                        logger.exception("Error in status callback")
+            if state not in self.pending_statuses:
+                with self._condition:
+                    # whoever removes the watch from self._watches resolves
+                    # its future
+                    owned = self._watches.get(watch.document_id) is watch
+                    if owned:
+                        del self._watches[watch.document_id]
+                    if state != "ERROR":
+                        duration = time.time() - watch.started
+                        if first_poll:
+                            # it finished earlier than expected, but we do not
+                            # know when, so aim lower for the next ones
+                            duration = duration / 2
+                        self.expected_duration = (
+                            0.8 * self.expected_duration + 0.2 * duration
+                        )
+                if owned:
+                    watch.future.set_result(response)
+                return
+
+        with self._condition:
+            if self._watches.get(watch.document_id) is watch:
+                self._schedule(watch, self._next_delay(watch))